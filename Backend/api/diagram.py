@@ -1,5 +1,6 @@
 import logging
 from fastapi import APIRouter, HTTPException, Header
+from fastapi.concurrency import run_in_threadpool
 
 from models import DiagramRequest, DiagramEditRequest, DiagramResponse
 from utils.diagram import generate_diagram_mermaid
@@ -29,15 +30,16 @@ async def generate_diagram(
     
     try:
         if num_variations == 1:
-            # Single generation
-            mermaid_code = generate_diagram_mermaid(request.prompt, api_key=x_openai_key)
+            # Single generation. The OpenAI client and its retry backoff are blocking,
+            # so they run in the threadpool to keep the event loop free.
+            mermaid_code = await run_in_threadpool(generate_diagram_mermaid, request.prompt, api_key=x_openai_key)
             return DiagramResponse(mermaid_code=mermaid_code)
         else:
             # Multiple variations
             variations = []
             for i in range(num_variations):
                 logger.info(f"Generating variation {i+1}/{num_variations}")
-                variation = generate_diagram_mermaid(request.prompt, api_key=x_openai_key)
+                variation = await run_in_threadpool(generate_diagram_mermaid, request.prompt, api_key=x_openai_key)
                 variations.append(variation)
             
 
@@ -69,7 +71,8 @@ async def edit_diagram(
         raise HTTPException(status_code=400, detail="Existing mermaid code cannot be empty")
     
     try:
-        updated_mermaid_code = edit_diagram_mermaid(
+        updated_mermaid_code = await run_in_threadpool(
+            edit_diagram_mermaid,
             user_prompt=request.prompt,
             existing_mermaid_code=request.existing_mermaid_code,
             api_key=x_openai_key
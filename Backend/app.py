@@ -1,18 +1,29 @@
 import logging
 import os
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from fastapi.responses import FileResponse
 from dotenv import load_dotenv
 from api import diagram, rl
+from utils.diagram import close_mermaid_client
 
 load_dotenv()
 
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Release shared HTTP clients when the app shuts down."""
+    yield
+    await close_mermaid_client()
+
+
 app = FastAPI(
     title="Mermaid Diagram Generator API",
     description="API to generate Mermaid UML diagrams from prompts",
-    version="0.0.8"
+    version="0.0.8",
+    lifespan=lifespan
 )
 
 # CORS Configuration
@@ -58,12 +69,15 @@ frontend_path = os.path.join(os.path.dirname(os.path.dirname(__file__)), "Fronte
 if os.path.exists(frontend_path):
     app.mount("/static", StaticFiles(directory=frontend_path), name="static")
 
+# Resolved once at startup instead of joining and stat-ing the path on every request
+index_path = os.path.join(frontend_path, "index.html")
+index_exists = os.path.exists(index_path)
+
 
 @app.get("/")
 async def root():
     """Serve the frontend index.html at the root"""
-    index_path = os.path.join(frontend_path, "index.html")
-    if os.path.exists(index_path):
+    if index_exists:
         return FileResponse(index_path)
     return {"message": "API is working. Frontend not found."}
 
@@ -305,6 +305,15 @@ FINAL INSTRUCTION
 - Do not include any explanations, comments, markdown formatting or note of any kind.
 """
 
+MERMAID_BATCH_INSTRUCTIONS = """
+
+BATCH MODE
+- The user message is a JSON object of the form {"requests": [{"id": 0, "prompt": "..."}, ...]}.
+- Generate one diagram per request, following every rule above for each diagram independently.
+- Output ONLY a JSON object of the form {"results": [{"id": 0, "mermaid": "..."}, ...]} with exactly one result per request id.
+- The "mermaid" value is the raw Mermaid source as a JSON string (newlines escaped as \\n), with no code fences.
+"""
+
 MERMAID_EDIT_SYSTEM_PROMPT = """You are a Mermaid diagram editor. Your task is to generate structured edit instructions for modifying existing Mermaid diagram code based on user instructions.
 
 CRITICAL: You must output ONLY a JSON object with edit instructions, NOT the complete updated code. The system will apply these edits automatically.
@@ -554,4 +563,13 @@ Rules:
 - If multiple edits are needed, include all in the "edits" array
 - Be precise with attribute/method signatures (include visibility, types, parameters)
 - For relationships, specify exact types and multiplicities if present
-- Preserve diagram type and overall structure unless explicitly asked to change"""
\ No newline at end of file
+- Preserve diagram type and overall structure unless explicitly asked to change"""
+
+MERMAID_EDIT_BATCH_INSTRUCTIONS = """
+
+BATCH MODE
+- The user message is a JSON object of the form {"requests": [{"id": 0, "diagram": "...", "prompt": "..."}, ...]}.
+- Each request is independent: generate edit instructions for its own "diagram" following every rule above.
+- Output ONLY a JSON object of the form {"results": [{"id": 0, "edits": [...]}, ...]} with exactly one result per request id.
+- Each "edits" value is the array you would return in the "edits" field for that request alone.
+"""
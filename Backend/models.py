@@ -18,6 +18,17 @@ class DiagramResponse(BaseModel):
     variations: Optional[List[str]] = None 
 
 
+# Edit instructions returned by the LLM (see MERMAID_EDIT_SYSTEM_PROMPT)
+class EditInstruction(BaseModel):
+    type: str
+    target: Optional[str] = None
+    details: Optional[dict] = None
+
+
+class EditInstructions(BaseModel):
+    edits: List[EditInstruction]
+
+
 # RL Action Models
 class RLActionRequest(BaseModel):
     action_type: str  
@@ -1,32 +1,126 @@
-import json
+import asyncio
+import functools
 import logging
+import os
 import re
 import base64
-from typing import Optional
-import dotenv
+from types import SimpleNamespace
+from typing import TYPE_CHECKING, List, Optional
 import httpx
+import orjson
+from tenacity import retry, retry_if_exception, stop_after_attempt, wait_random_exponential
 
-from constants import OPENAI_MODEL_NAME, MERMAID_SYSTEM_PROMPT
-from openai import OpenAI
-from utils.logger import log_llm_call
+from constants import OPENAI_MODEL_NAME, MERMAID_SYSTEM_PROMPT, MERMAID_BATCH_INSTRUCTIONS
+from utils.logger import log_llm_call, preview
+
+try:
+    # Optional: rasterize SVG locally instead of using mermaid.ink's headless browser PNG path.
+    # Opt-in via MERMAID_LOCAL_PNG: cairosvg drops <foreignObject>, which is where mermaid.ink
+    # puts flowchart and class diagram labels, so those PNGs come out without text.
+    import cairosvg
+except (ImportError, OSError):
+    cairosvg = None
+
+if TYPE_CHECKING:
+    from openai import OpenAI
 
 
-OPANAI_API_KEY = dotenv.get_key('.env', 'OPENAI_API_KEY')  # Ensure .env is loaded
 logger = logging.getLogger(__name__)
 
+# Escape sequences the model may emit literally inside Mermaid code
+_ESCAPE_RE = re.compile(r'\\(.)')
+_ESCAPE_MAP = {'n': '\n', 't': '\t', 'r': '\r', '"': '"', "'": "'", '\\': '\\'}
+
+# Shared connection pool for all OpenAI clients, sized for concurrent requests
+_OPENAI_HTTP_CLIENT = httpx.Client(
+    transport=httpx.HTTPTransport(retries=2),
+    limits=httpx.Limits(max_connections=200, max_keepalive_connections=100),
+)
+
+_MERMAID_HEADER_RE = re.compile(
+    r'^(graph|flowchart|sequenceDiagram|classDiagram|stateDiagram(-v2)?|erDiagram|gantt|journey|pie|mindmap|timeline|gitGraph)\b'
+)
+_MERMAID_BASE = "https://mermaid.ink/"
+_MERMAID_ENDPOINTS = {"png": "img", "svg": "svg"}
+
+# Shared async client for mermaid.ink renders issued from async code. Created on
+# first use (inside the running loop) and closed by close_mermaid_client on shutdown.
+_mermaid_aclient: Optional[httpx.AsyncClient] = None
+_MAX_CONCURRENT_RENDERS = 20
+
+
+def _get_mermaid_aclient() -> httpx.AsyncClient:
+    """Returns the shared mermaid.ink AsyncClient, creating it on first use."""
+    global _mermaid_aclient
+    if _mermaid_aclient is None or _mermaid_aclient.is_closed:
+        _mermaid_aclient = httpx.AsyncClient(timeout=30.0)
+    return _mermaid_aclient
+
+
+async def close_mermaid_client():
+    """Close the shared mermaid.ink AsyncClient."""
+    global _mermaid_aclient
+    if _mermaid_aclient is not None:
+        await _mermaid_aclient.aclose()
+        _mermaid_aclient = None
+
 
-def get_openai_client(api_key: str = None):
+@functools.lru_cache(maxsize=1)
+def _get_env_key() -> Optional[str]:
+    """Reads OPENAI_API_KEY from .env once, on first use."""
+    import dotenv
+
+    return dotenv.get_key('.env', 'OPENAI_API_KEY')
+
+
+def get_openai_client(api_key: str = None) -> "OpenAI":
     """
     Returns an OpenAI client instance.
     Args:
         api_key: Optional API key. If not provided, tries to load from .env
     """
     if not api_key:
-        api_key = OPANAI_API_KEY
+        api_key = _get_env_key()
     
     if not api_key:
         raise ValueError("OpenAI API key not found. Please provide it in settings or .env file")
-    return OpenAI(api_key=api_key)
+    return _build_openai_client(api_key)
+
+
+@functools.lru_cache(maxsize=4)
+def _build_openai_client(api_key: str) -> "OpenAI":
+    """Builds (once per API key) an OpenAI client on the shared connection pool."""
+    # Imported lazily so the render path does not pay for the SDK's import graph
+    from openai import OpenAI
+
+    # Retries are handled by create_chat_completion so they are not compounded
+    return OpenAI(api_key=api_key, http_client=_OPENAI_HTTP_CLIENT, max_retries=0)
+
+
+def _is_retryable_openai_error(e: BaseException) -> bool:
+    """Whether an OpenAI error is a rate limit or transient failure worth retrying."""
+    import openai
+
+    return isinstance(e, (
+        openai.RateLimitError,
+        openai.APITimeoutError,
+        openai.APIConnectionError,
+        openai.InternalServerError,
+    ))
+
+
+@retry(
+    stop=stop_after_attempt(3),
+    wait=wait_random_exponential(min=1, max=20),
+    retry=retry_if_exception(_is_retryable_openai_error),
+    reraise=True,
+)
+def create_chat_completion(openai_client: "OpenAI", **kwargs):
+    """
+    Calls chat.completions.create, retrying rate limits and transient failures
+    with exponential backoff (up to 3 attempts).
+    """
+    return openai_client.chat.completions.create(**kwargs)
 
 
 def extract_mermaid_code(text: str) -> str:
@@ -65,98 +159,241 @@ def unescape_mermaid_code(mermaid_code: str) -> str:
     Returns:
         str: The unescaped Mermaid code ready for rendering
     """
-    try:
-        if mermaid_code.startswith('"') and mermaid_code.endswith('"'):
-            try:
-                # If it's a JSON-encoded string, decode it first
-                # This handles cases where the entire string is JSON-encoded
-                mermaid_code = json.loads(mermaid_code)
-            except json.JSONDecodeError:
-                # If JSON decode fails, continue with original string
-                pass
-        
-
+    if mermaid_code.startswith('"') and mermaid_code.endswith('"'):
         try:
-            unescaped = mermaid_code.encode('utf-8').decode('unicode_escape')
-        except (UnicodeDecodeError, ValueError, UnicodeEncodeError):
-            unescaped = mermaid_code
-            escape_replacements = [
-                ('\\\\', '\x00BACKSLASH\x00'),
-                ('\\n', '\n'),
-                ('\\t', '\t'),
-                ('\\r', '\r'),
-                ('\\"', '"'),
-                ("\\'", "'"),
-                ('\x00BACKSLASH\x00', '\\'),
-            ]
-            
-            for old, new in escape_replacements:
-                unescaped = unescaped.replace(old, new)
-        
-        return unescaped
-    except Exception as e:
-        logger.warning(f"Error unescaping Mermaid code, using original: {e}")
-        return mermaid_code
+            # If it's a JSON-encoded string, decode it first
+            # This handles cases where the entire string is JSON-encoded
+            mermaid_code = orjson.loads(mermaid_code)
+        except orjson.JSONDecodeError:
+            # If JSON decode fails, continue with original string
+            pass
+
+    # Single pass over the string; unknown escapes are left untouched
+    return _ESCAPE_RE.sub(lambda m: _ESCAPE_MAP.get(m.group(1), m.group(0)), mermaid_code)
 
 
-def render_mermaid_to_image(mermaid_code: str, format: str = "png") -> Optional[bytes]:
+def _validate_mermaid(code: str) -> bool:
+    """
+    Cheap structural check that there is a diagram to render once a leading YAML
+    front matter block (--- ... ---), blank lines and %% comments/directives are
+    skipped. Headers missing from _MERMAID_HEADER_RE are let through: this check
+    must never be stricter than the renderer, which knows every diagram type.
+    """
+    lines = code.splitlines()
+    start = 0
+    first = next((i for i, line in enumerate(lines) if line.strip()), None)
+    if first is not None and lines[first].strip() == '---':
+        # Front matter holds the title/config; the diagram header follows its closing ---
+        end = next((i for i in range(first + 1, len(lines)) if lines[i].strip() == '---'), None)
+        if end is not None:
+            start = end + 1
+
+    for line in lines[start:]:
+        line = line.strip()
+        if not line or line.startswith('%%'):
+            continue
+        if _MERMAID_HEADER_RE.match(line) is None and logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"Unrecognised Mermaid header, leaving it to the renderer: {preview(line)}")
+        return True
+    return False
+
+
+def _build_mermaid_url(mermaid_code: str, format: str) -> Optional[str]:
+    """
+    Builds the mermaid.ink URL for the given Mermaid code and image format.
+    Returns None when the code fails local validation, so no request is made.
+    """
+    cleaned_code = unescape_mermaid_code(mermaid_code)
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(f"Cleaned Mermaid code (first 200 chars): {preview(cleaned_code, 200)}")
+
+    if not _validate_mermaid(cleaned_code):
+        logger.error("Not rendering Mermaid diagram: code contains no diagram")
+        return None
+
+    endpoint = _MERMAID_ENDPOINTS.get(format.lower(), "img")
+    url = f"{_MERMAID_BASE}{endpoint}/" + base64.urlsafe_b64encode(cleaned_code.encode()).rstrip(b'=').decode('ascii')
+
+    logger.info(f"Rendering Mermaid diagram to {format} via mermaid.ink")
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(f"Request URL (first 100 chars): {preview(url)}")
+    return url
+
+
+def _read_mermaid_response(response: httpx.Response) -> Optional[bytes]:
+    """Returns the image bytes from a mermaid.ink response, or None if it is not an image."""
+    response.raise_for_status()
+
+    content_type = response.headers.get('content-type', '')
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(f"Response status: {response.status_code}, content type: {content_type}")
+
+    if content_type.startswith('image/') or content_type == 'image/svg+xml':
+        image_size = len(response.content)
+        logger.info(f"Successfully rendered image, size: {image_size} bytes")
+        return response.content
+    else:
+        response_text = response.text[:500] if hasattr(response, 'text') else str(response.content[:500])
+        logger.error(f"Unexpected content type: {content_type}")
+        logger.error(f"Response body: {response_text}")
+        return None
+
+
+def _log_render_error(e: Exception, url: Optional[str]) -> None:
+    """Logs a failed mermaid.ink render."""
+    if isinstance(e, httpx.HTTPStatusError):
+        error_text = e.response.text[:500] if hasattr(e.response, 'text') else str(e.response.content[:500])
+        logger.error(f"HTTP error rendering Mermaid diagram: {e.response.status_code}")
+        logger.error(f"Error response: {error_text}")
+        logger.error(f"Request URL was: {url or 'N/A'}")
+    elif isinstance(e, httpx.RequestError):
+        logger.error(f"Request error rendering Mermaid diagram: {e}")
+    else:
+        logger.error(f"Error rendering Mermaid diagram: {e}", exc_info=True)
+
+
+def _rasterize_locally(format: str) -> bool:
+    """Whether a PNG should be produced by fetching SVG and converting it in-process."""
+    # Read per call: app.py loads .env after this module is imported
+    return (cairosvg is not None and format.lower() == "png" and
+            os.getenv("MERMAID_LOCAL_PNG", "").lower() in ("1", "true", "yes"))
+
+
+def render_mermaid_to_image(mermaid_code: str, format: str = "svg") -> Optional[bytes]:
     """
     Renders Mermaid code to an image using mermaid.ink API.
+    PNG is rasterized locally from the SVG when MERMAID_LOCAL_PNG is set and
+    cairosvg is installed.
     
     Args:
         mermaid_code (str): The Mermaid diagram code (may contain escape sequences)
-        format (str): Image format - 'png' or 'svg' (default: 'png')
+        format (str): Image format - 'png' or 'svg' (default: 'svg')
         
     Returns:
         bytes: Image data as bytes, or None if rendering fails
     """
+    url = None
     try:
-        cleaned_code = unescape_mermaid_code(mermaid_code)
-        logger.debug(f"Cleaned Mermaid code (first 200 chars): {cleaned_code[:200]}")
-        
-        mermaid_base64 = base64.urlsafe_b64encode(cleaned_code.encode('utf-8')).decode('utf-8')
-        mermaid_base64 = mermaid_base64.rstrip('=')
-        
-        endpoint = "svg" if format.lower() == "svg" else "img"
-        url = f"https://mermaid.ink/{endpoint}/{mermaid_base64}"
-        
-        logger.info(f"Rendering Mermaid diagram to {format} via mermaid.ink")
-        logger.debug(f"Request URL (first 100 chars): {url[:100]}...")
-        
+        local_png = _rasterize_locally(format)
+        url = _build_mermaid_url(mermaid_code, "svg" if local_png else format)
+        if url is None:
+            return None
         with httpx.Client(timeout=30.0) as client:
-            response = client.get(url)
-            logger.debug(f"Response status: {response.status_code}")
-            logger.debug(f"Response headers: {dict(response.headers)}")
-            
-            response.raise_for_status()
-            
-            content_type = response.headers.get('content-type', '')
-            logger.debug(f"Content type: {content_type}")
-            
-            if content_type.startswith('image/') or content_type == 'image/svg+xml':
-                image_size = len(response.content)
-                logger.info(f"Successfully rendered image, size: {image_size} bytes")
-                return response.content
-            else:
-                response_text = response.text[:500] if hasattr(response, 'text') else str(response.content[:500])
-                logger.error(f"Unexpected content type: {content_type}")
-                logger.error(f"Response body: {response_text}")
-                return None
-                
-    except httpx.HTTPStatusError as e:
-        error_text = e.response.text[:500] if hasattr(e.response, 'text') else str(e.response.content[:500])
-        logger.error(f"HTTP error rendering Mermaid diagram: {e.response.status_code}")
-        logger.error(f"Error response: {error_text}")
-        logger.error(f"Request URL was: {url if 'url' in locals() else 'N/A'}")
-        return None
-    except httpx.RequestError as e:
-        logger.error(f"Request error rendering Mermaid diagram: {e}")
+            image = _read_mermaid_response(client.get(url))
+        if image is not None and local_png:
+            image = cairosvg.svg2png(bytestring=image)
+        return image
+    except Exception as e:
+        _log_render_error(e, url)
         return None
+
+
+async def render_mermaid_to_image_async(mermaid_code: str, format: str = "svg") -> Optional[bytes]:
+    """
+    Async variant of render_mermaid_to_image that uses the shared AsyncClient,
+    so renders issued from async code do not block the event loop.
+
+    Args:
+        mermaid_code (str): The Mermaid diagram code (may contain escape sequences)
+        format (str): Image format - 'png' or 'svg' (default: 'svg')
+
+    Returns:
+        bytes: Image data as bytes, or None if rendering fails
+    """
+    url = None
+    try:
+        local_png = _rasterize_locally(format)
+        url = _build_mermaid_url(mermaid_code, "svg" if local_png else format)
+        if url is None:
+            return None
+        image = _read_mermaid_response(await _get_mermaid_aclient().get(url))
+        if image is not None and local_png:
+            image = await asyncio.to_thread(cairosvg.svg2png, bytestring=image)
+        return image
     except Exception as e:
-        logger.error(f"Error rendering Mermaid diagram: {e}", exc_info=True)
+        _log_render_error(e, url)
         return None
 
 
+async def render_many(mermaid_codes: List[str], format: str = "svg") -> List[Optional[bytes]]:
+    """
+    Renders several diagrams concurrently (at most _MAX_CONCURRENT_RENDERS in flight).
+
+    Args:
+        mermaid_codes (List[str]): The Mermaid diagrams to render.
+        format (str): Image format - 'png' or 'svg' (default: 'svg')
+
+    Returns:
+        List[Optional[bytes]]: Image data for each diagram, None where rendering failed.
+    """
+    semaphore = asyncio.Semaphore(_MAX_CONCURRENT_RENDERS)
+
+    async def _render(mermaid_code: str) -> Optional[bytes]:
+        async with semaphore:
+            return await render_mermaid_to_image_async(mermaid_code, format)
+
+    return await asyncio.gather(*(_render(code) for code in mermaid_codes))
+
+
+def _collect_streamed_answer(stream) -> SimpleNamespace:
+    """
+    Accumulates a streamed chat completion into a response-shaped object.
+
+    Stops reading as soon as a closing ``` fence follows an opening one, since
+    extract_mermaid_code only needs the fenced block.
+
+    Args:
+        stream: The stream returned by chat.completions.create(stream=True).
+
+    Returns:
+        SimpleNamespace: Object exposing .choices[0].message.content (and
+        .usage when the API reported it) for log_llm_call.
+    """
+    parts = []
+    fences = 0
+    tail = ""
+    finish_reason = None
+    usage = None
+
+    for chunk in stream:
+        if getattr(chunk, "usage", None):
+            usage = chunk.usage
+        if not chunk.choices:
+            continue
+
+        choice = chunk.choices[0]
+        content = choice.delta.content or ""
+        if choice.finish_reason:
+            finish_reason = choice.finish_reason
+        if not content:
+            continue
+        parts.append(content)
+
+        # Count fences across chunk boundaries without rescanning the whole answer
+        window = tail + content
+        found = window.count("```")
+        if found:
+            fences += found
+            window = window[window.rfind("```") + 3:]
+        tail = window[-2:]
+
+        if fences >= 2:
+            finish_reason = finish_reason or "stop"
+            if hasattr(stream, "close"):
+                stream.close()
+            break
+
+    response = SimpleNamespace(
+        choices=[SimpleNamespace(
+            message=SimpleNamespace(content="".join(parts)),
+            finish_reason=finish_reason
+        )]
+    )
+    if usage is not None:
+        response.usage = usage
+    return response
+
+
 def generate_diagram_mermaid(user_prompt: str, api_key: str = None) -> str:
     """
     Calls OpenAI API to generate a Mermaid UML diagram code for the user's prompt.
@@ -173,20 +410,23 @@ def generate_diagram_mermaid(user_prompt: str, api_key: str = None) -> str:
         
         system_prompt = MERMAID_SYSTEM_PROMPT
 
-        logger.info(f"Generating Mermaid UML diagram for prompt: {user_prompt[:100]}...")
+        logger.info(f"Generating Mermaid UML diagram for prompt: {preview(user_prompt)}")
 
         messages = [
             {"role": "system", "content": system_prompt},
             {"role": "user", "content": user_prompt}
         ]
         
-        response = openai_client.chat.completions.create(
+        stream = create_chat_completion(
+            openai_client,
             model=OPENAI_MODEL_NAME,
             messages=messages,
             temperature=0.3,
             top_p=0.7,
-            stream=False,
+            stream=True,
+            stream_options={"include_usage": True},
         )
+        response = _collect_streamed_answer(stream)
 
         log_llm_call(
             model=OPENAI_MODEL_NAME,
@@ -220,4 +460,73 @@ def generate_diagram_mermaid(user_prompt: str, api_key: str = None) -> str:
         raise
 
 
+def generate_diagrams_multi(prompts: List[str], api_key: str = None) -> List[str]:
+    """
+    Generates one Mermaid diagram per prompt using a single OpenAI call, so the
+    system prompt is only sent once for the whole batch.
+
+    Args:
+        prompts (List[str]): The user prompts, one diagram each.
+        api_key (str): Optional OpenAI API key.
+
+    Returns:
+        List[str]: The Mermaid code for each prompt, in the same order.
+    """
+    if not prompts:
+        return []
+
+    messages = [
+        {"role": "system", "content": MERMAID_SYSTEM_PROMPT + MERMAID_BATCH_INSTRUCTIONS},
+        {"role": "user", "content": orjson.dumps({"requests": [{"id": i, "prompt": p} for i, p in enumerate(prompts)]}).decode()}
+    ]
+
+    try:
+        openai_client = get_openai_client(api_key)
+
+        logger.info(f"Generating {len(prompts)} Mermaid diagrams in one batch")
+
+        response = create_chat_completion(
+            openai_client,
+            model=OPENAI_MODEL_NAME,
+            messages=messages,
+            temperature=0.3,
+            top_p=0.7,
+            response_format={"type": "json_object"},
+            stream=False,
+        )
+
+        log_llm_call(
+            model=OPENAI_MODEL_NAME,
+            messages=messages,
+            response=response,
+            temperature=0.3,
+            top_p=0.7,
+            function_name="generate_diagrams_multi"
+        )
+
+        try:
+            results = orjson.loads(response.choices[0].message.content)["results"]
+            by_id = {int(r["id"]): r["mermaid"] for r in results}
+        except (orjson.JSONDecodeError, KeyError, TypeError, ValueError) as e:
+            raise ValueError(f"Failed to parse batched diagram response: {e}")
+
+        missing = [i for i in range(len(prompts)) if i not in by_id]
+        if missing:
+            raise ValueError(f"Batched diagram response is missing results for ids {missing}")
+
+        mermaid_codes = [unescape_mermaid_code(extract_mermaid_code(by_id[i])) for i in range(len(prompts))]
+
+        logger.info(f"Generated {len(mermaid_codes)} Mermaid diagrams in one batch")
+        return mermaid_codes
 
+    except Exception as e:
+        log_llm_call(
+            model=OPENAI_MODEL_NAME,
+            messages=messages,
+            temperature=0.3,
+            top_p=0.7,
+            error=str(e),
+            function_name="generate_diagrams_multi"
+        )
+        logger.error(f"Error while generating batched Mermaid diagrams: {e}", exc_info=True)
+        raise
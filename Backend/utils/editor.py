@@ -1,13 +1,329 @@
-import json
 import logging
 import re
-
-from constants import OPENAI_MODEL_NAME, MERMAID_EDIT_SYSTEM_PROMPT
-from utils.diagram import get_openai_client
-from utils.logger import log_llm_call, log_mermaid_code
+import threading
+from bisect import bisect_left, insort
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from functools import lru_cache
+from itertools import groupby
+from types import SimpleNamespace
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+import orjson
+from pydantic import ValidationError
+
+from constants import OPENAI_MODEL_NAME, MERMAID_EDIT_SYSTEM_PROMPT, MERMAID_EDIT_BATCH_INSTRUCTIONS
+from models import EditInstructions
+from utils.diagram import create_chat_completion, get_openai_client
+from utils.logger import log_llm_call, log_mermaid_code, preview
 
 logger = logging.getLogger(__name__)
 
+# Static patterns, compiled once at import
+_REL_LINE_RE = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*\s*(<|--|\.\.|o--|\*--)')
+_REL_PARSE_RE = re.compile(
+    r'^([A-Za-z_]\w*)\s*(?:"([^"]*)")?\s*([<*o]?\|?(?:--|\.\.)\|?[>*o]?)\s*(?:"([^"]*)")?\s*([A-Za-z_]\w*)(?:\s*:\s*(.*))?$'
+)
+
+_MSG_PARSE_RE = re.compile(
+    r'^(?P<from>"[^"]+"|[^":]+?)\s*(?P<arrow>--?>>?)[+-]?\s*(?P<to>"[^"]+"|[^":]+?)\s*(?::\s*(?P<text>.*))?$'
+)
+
+# Name-specific patterns, cached so repeated edits on the same class reuse them
+@lru_cache(maxsize=512)
+def _class_attr_re(name: str) -> re.Pattern:
+    return re.compile(rf'^{re.escape(name)}\s*:\s*[+\-#~]')
+
+
+@lru_cache(maxsize=512)
+def _class_member_re(name: str) -> re.Pattern:
+    return re.compile(rf'^{re.escape(name)}\s*:\s*')
+
+
+@lru_cache(maxsize=512)
+def _word_re(name: str) -> re.Pattern:
+    return re.compile(rf'\b{re.escape(name)}\b')
+
+
+@lru_cache(maxsize=128)
+def _words_re(names: tuple) -> re.Pattern:
+    # Longest first so a name is never shadowed by one of its prefixes
+    alternation = '|'.join(re.escape(name) for name in sorted(names, key=len, reverse=True))
+    return re.compile(rf'\b({alternation})\b')
+
+
+class _Relationship(NamedTuple):
+    """A class diagram relationship line, e.g. `A "1" --> "*" B : owns`."""
+    from_: str
+    mult_from: Optional[str]
+    type_: str
+    mult_to: Optional[str]
+    to: str
+    label: Optional[str]
+
+
+class _Message(NamedTuple):
+    """A sequence diagram message line, e.g. `Client->>"NLP Extractor": parse(text)`."""
+    from_: str  # participant names are stored without quotes
+    arrow: str
+    to: str
+    text: Optional[str]
+
+
+def _parse_message(line: str) -> Optional[_Message]:
+    """Parse a stripped message line, or return None if it is not one."""
+    match = _MSG_PARSE_RE.match(line)
+    if not match:
+        return None
+    return _Message(match['from'].strip('"'), match['arrow'], match['to'].strip('"'), match['text'])
+
+
+def _has_rel(line: str) -> bool:
+    """Check whether a line contains a class relationship arrow (<, --, .., o--, *--)."""
+    # o-- and *-- contain --, so three substring tests cover every arrow
+    return '--' in line or '..' in line or '<' in line
+
+
+def _has_msg_arrow(line: str) -> bool:
+    """Check whether a line contains a sequence message arrow (->, ->>, -->, -->>)."""
+    # Every message arrow contains ->
+    return '->' in line
+
+
+def _is_relationship_line(line: str) -> bool:
+    """Check whether a stripped line starts with `Name <arrow>`."""
+    return _has_rel(line) and _REL_LINE_RE.match(line) is not None
+
+
+def _format_relationship(from_class: str, rel_type: str, to_class: str, mult_from: Optional[str] = None,
+                         mult_to: Optional[str] = None, label: Optional[str] = None) -> str:
+    """Render a relationship line, quoting multiplicities and appending the label if present."""
+    mult_from = f' "{mult_from}"' if mult_from else ''
+    mult_to = f' "{mult_to}"' if mult_to else ''
+    label = f' : {label}' if label else ''
+    return f'{from_class}{mult_from} {rel_type}{mult_to} {to_class}{label}'
+
+
+_ARROW_MIRROR = str.maketrans('<>', '><')
+
+
+def _mirror_rel_type(rel_type: str) -> str:
+    """Return the same relationship arrow pointing the other way, e.g. `..>` -> `<..`, `<|--` -> `--|>`."""
+    return rel_type[::-1].translate(_ARROW_MIRROR)
+
+
+def _connects(rel: Optional[_Relationship], from_class: str, to_class: str) -> bool:
+    """Whether a parsed relationship joins exactly these two classes, in either direction."""
+    return rel is not None and ((rel.from_, rel.to) == (from_class, to_class) or
+                                (rel.from_, rel.to) == (to_class, from_class))
+
+
+def _parse_relationship(line: str) -> Optional[_Relationship]:
+    """Parse a stripped relationship line, or return None if it is not one."""
+    match = _REL_PARSE_RE.match(line)
+    return _Relationship(*match.groups()) if match else None
+
+
+@dataclass
+class _DiagramIndex:
+    """
+    Positions of the structurally interesting lines of a diagram, built in a
+    single pass and kept in sync as edits insert, remove or rewrite lines.
+
+    Every position list is kept sorted so shifts only touch the tail.
+    """
+    lines: List[str]
+    stripped: List[str] = field(default_factory=list)  # parallel to lines
+    diagram_type: str = 'unknown'
+    header: List[int] = field(default_factory=list)  # the `classDiagram`/`sequenceDiagram`/... line, if any
+    class_line: Dict[str, List[int]] = field(default_factory=dict)  # `class X` lines, keyed by lowercased X
+    quoted_class_line: Dict[str, List[int]] = field(default_factory=dict)  # `class "X"` lines, keyed by X
+    class_starts: List[int] = field(default_factory=list)  # every line starting with `class `
+    relationships: List[int] = field(default_factory=list)
+    relationship_records: List[Optional[_Relationship]] = field(default_factory=list)  # parallel to relationships
+    participants: List[int] = field(default_factory=list)
+    messages: List[int] = field(default_factory=list)  # every `->` line, so state transitions too
+    message_records: List[Optional[_Message]] = field(default_factory=list)  # parallel to messages
+    notes: List[int] = field(default_factory=list)
+    state_starts: List[int] = field(default_factory=list)  # `state X` lines (composite or described states)
+    _member_ranges: Dict[Tuple[str, int], Tuple[int, int]] = field(default_factory=dict, repr=False)
+    _changed: bool = field(default=False, repr=False)
+
+    @classmethod
+    def build(cls, lines: List[str]) -> "_DiagramIndex":
+        index = cls(lines, [line.strip() for line in lines])
+        # Positions arrive in ascending order here, so appending keeps every list sorted
+        classify = index._classify
+        append = list.append
+        for i, stripped in enumerate(index.stripped):
+            if stripped:
+                classify(i, stripped, append)
+        index.diagram_type, header_idx = _detect_diagram_type(index.stripped)
+        if header_idx >= 0:
+            index.header.append(header_idx)
+        return index
+
+    def find_class(self, class_name: str) -> int:
+        """Return the line index where a class is defined, or -1 if not found."""
+        found = [positions[0] for positions in (self.class_line.get(class_name.lower()),
+                                                self.quoted_class_line.get(class_name)) if positions]
+        return min(found) if found else -1
+
+    def member_range(self, class_name: str, class_idx: int) -> Tuple[int, int]:
+        """
+        Return (start, end) of a class's colon-syntax member lines, cached until
+        the diagram next changes. start is -1 when the class has no attributes,
+        in which case end is measured from the line after the class.
+        """
+        key = (class_name, class_idx)
+        cached = self._member_ranges.get(key)
+        if cached is None:
+            start = _find_class_attributes_start(self.stripped, class_name, class_idx)
+            end = _find_class_attributes_end(self.stripped, class_name, start if start >= 0 else class_idx + 1)
+            cached = self._member_ranges[key] = (start, end)
+        return cached
+
+    def insert(self, idx: int, new_lines: List[str]) -> None:
+        """Insert new_lines before idx, shifting every indexed position after it."""
+        self._mark_changed()
+        self.lines[idx:idx] = new_lines
+        self.stripped[idx:idx] = [line.strip() for line in new_lines]
+        count = len(new_lines)
+        for positions in self._all_positions():
+            j = bisect_left(positions, idx)
+            if j < len(positions):
+                positions[j:] = [p + count for p in positions[j:]]
+        for i in range(idx, idx + count):
+            self._classify(i, self.stripped[i])
+
+    def pop(self, idx: int) -> str:
+        """Remove the line at idx, shifting every indexed position after it."""
+        self._mark_changed()
+        self._unclassify(idx)
+        line = self.lines.pop(idx)
+        self.stripped.pop(idx)
+        for positions in self._all_positions():
+            j = bisect_left(positions, idx)
+            if j < len(positions):
+                positions[j:] = [p - 1 for p in positions[j:]]
+        return line
+
+    def remove(self, indices) -> None:
+        """Remove every line in indices with a single filter pass over the diagram."""
+        indices = set(indices)
+        if not indices:
+            return
+        self._mark_changed()
+        removed = sorted(indices)
+
+        def shifted(positions):
+            return [p - bisect_left(removed, p) for p in positions if p not in indices]
+
+        self.lines[:] = [line for i, line in enumerate(self.lines) if i not in indices]
+        self.stripped[:] = [line for i, line in enumerate(self.stripped) if i not in indices]
+        self.relationship_records[:] = [record for p, record in zip(self.relationships, self.relationship_records)
+                                        if p not in indices]
+        self.message_records[:] = [record for p, record in zip(self.messages, self.message_records)
+                                   if p not in indices]
+        for positions in (self.header, self.class_starts, self.relationships, self.participants, self.messages,
+                          self.notes, self.state_starts):
+            positions[:] = shifted(positions)
+        for mapping in (self.class_line, self.quoted_class_line):
+            for name in list(mapping):
+                mapping[name] = shifted(mapping[name])
+                if not mapping[name]:
+                    del mapping[name]
+
+    def replace(self, idx: int, line: str) -> None:
+        """Rewrite the line at idx and re-index it."""
+        if self.lines[idx] == line:
+            return
+        self._mark_changed()
+        self._unclassify(idx)
+        self.lines[idx] = line
+        self.stripped[idx] = line.strip()
+        self._classify(idx, self.stripped[idx])
+
+    @property
+    def changed(self) -> bool:
+        """Whether any edit has modified the diagram since it was indexed."""
+        return self._changed
+
+    def _mark_changed(self) -> None:
+        self._changed = True
+        self._member_ranges.clear()
+
+    def _all_positions(self):
+        yield self.header
+        yield self.class_starts
+        yield self.relationships
+        yield self.participants
+        yield self.messages
+        yield self.notes
+        yield self.state_starts
+        yield from self.class_line.values()
+        yield from self.quoted_class_line.values()
+
+    @staticmethod
+    def _class_keys(stripped: str):
+        """Return the (lowercased, quoted) lookup keys for a class definition line."""
+        # `class` (any case), whitespace, then the name up to the end of the line
+        if stripped[:5].lower() != 'class' or not stripped[5:6].isspace():
+            return None, None
+        name = stripped[5:].lstrip()
+        quoted = name[1:-1] if stripped.startswith('class') and len(name) >= 2 and \
+            name.startswith('"') and name.endswith('"') else None
+        return name.lower(), quoted
+
+    def _classify(self, i: int, stripped: str, add=insort) -> None:
+        """Record line i under every category it belongs to, adding positions with add."""
+        key, quoted = self._class_keys(stripped)
+        if key is not None:
+            add(self.class_line.setdefault(key, []), i)
+            if quoted is not None:
+                add(self.quoted_class_line.setdefault(quoted, []), i)
+            if stripped.startswith('class '):
+                add(self.class_starts, i)
+        if _has_rel(stripped):
+            j = bisect_left(self.relationships, i)
+            self.relationships.insert(j, i)
+            self.relationship_records.insert(j, _parse_relationship(stripped))
+        if _has_msg_arrow(stripped):
+            j = bisect_left(self.messages, i)
+            self.messages.insert(j, i)
+            self.message_records.insert(j, _parse_message(stripped))
+        if stripped.startswith('participant '):
+            add(self.participants, i)
+        elif stripped.startswith('note '):
+            add(self.notes, i)
+        elif stripped.startswith('state '):
+            add(self.state_starts, i)
+
+    def _unclassify(self, i: int) -> None:
+        key, quoted = self._class_keys(self.stripped[i])
+        for mapping, name in ((self.class_line, key), (self.quoted_class_line, quoted)):
+            if name is not None:
+                _discard_position(mapping[name], i)
+                if not mapping[name]:
+                    del mapping[name]
+        j = _discard_position(self.relationships, i)
+        if j >= 0:
+            del self.relationship_records[j]
+        j = _discard_position(self.messages, i)
+        if j >= 0:
+            del self.message_records[j]
+        for positions in (self.header, self.class_starts, self.participants, self.notes, self.state_starts):
+            _discard_position(positions, i)
+
+
+def _discard_position(positions: List[int], i: int) -> int:
+    """Remove i from a sorted position list, returning where it was or -1."""
+    j = bisect_left(positions, i)
+    if j < len(positions) and positions[j] == i:
+        del positions[j]
+        return j
+    return -1
+
 
 def apply_mermaid_edit(existing_mermaid_code: str, edit_instructions: dict) -> str:
     """
@@ -24,124 +340,131 @@ def apply_mermaid_edit(existing_mermaid_code: str, edit_instructions: dict) -> s
         logger.warning("No edits found in edit instructions")
         return existing_mermaid_code
     
-    lines = existing_mermaid_code.split('\n')
-    diagram_type = _detect_diagram_type(lines)
+    # Applying edits is pure, so a repeated request (e.g. a retried edit) is
+    # served from cache; the edits are keyed by their canonical JSON
+    return _apply_edits_cached(existing_mermaid_code, orjson.dumps(edit_instructions["edits"], option=orjson.OPT_SORT_KEYS))
+
+
+@lru_cache(maxsize=256)
+def _apply_edits_cached(existing_mermaid_code: str, edits_json: bytes) -> str:
+    return _apply_edits(existing_mermaid_code, orjson.loads(edits_json))
+
+
+def _apply_edits(existing_mermaid_code: str, edits: list) -> str:
+    """Apply a list of edits to Mermaid code using the line index."""
+    edits = list(_valid_edits(edits))
+    if not edits:
+        return existing_mermaid_code
+
+    index = _DiagramIndex.build(existing_mermaid_code.split('\n'))
     
-    for edit in edit_instructions["edits"]:
+    for edit_type, group in groupby(edits, key=lambda e: e["type"]):
+        # Edits meant for another kind of diagram would only write invalid lines
+        diagram_type = _EDIT_DIAGRAM_TYPES.get(edit_type)
+        if diagram_type and index.diagram_type not in (diagram_type, 'unknown'):
+            logger.warning(f"Skipping {edit_type} edits on a {index.diagram_type} diagram")
+            continue
+        if edit_type in _BATCHED:
+            # Consecutive edits of these types share one scan and one splice of the diagram
+            group = [{"type": edit_type, "batch": list(group)}]
+        handler = _DISPATCH[edit_type]
+        for edit in group:
+            try:
+                handler(index, edit)
+            except Exception as e:
+                logger.error(f"Error applying edit {edit_type}: {e}", exc_info=True)
+
+    # Edits that matched nothing leave the original text as is; no need to rebuild it
+    if not index.changed:
+        return existing_mermaid_code
+    return '\n'.join(index.lines)
+
+
+def _valid_edits(edits: list):
+    """Yield the edits that have a known type and every field their handler needs."""
+    previous = None
+    for edit in edits:
         edit_type = edit.get("type")
         if not edit_type:
             continue
-            
-        try:
-            if edit_type == "add_class":
-                lines = _apply_add_class(lines, edit.get("details", {}))
-            elif edit_type == "remove_class":
-                lines = _apply_remove_class(lines, edit.get("target"))
-            elif edit_type == "modify_class":
-                lines = _apply_modify_class(lines, edit.get("target"), edit.get("details", {}))
-            elif edit_type == "add_relationship":
-                lines = _apply_add_relationship(lines, edit.get("details", {}))
-            elif edit_type == "remove_relationship":
-                lines = _apply_remove_relationship(lines, edit.get("details", {}))
-            elif edit_type == "modify_relationship":
-                lines = _apply_modify_relationship(lines, edit.get("details", {}))
-            elif edit_type == "add_attribute":
-                lines = _apply_add_attribute(lines, edit.get("target"), edit.get("details", {}))
-            elif edit_type == "remove_attribute":
-                lines = _apply_remove_attribute(lines, edit.get("target"), edit.get("details", {}))
-            elif edit_type == "modify_attribute":
-                lines = _apply_modify_attribute(lines, edit.get("target"), edit.get("details", {}))
-            elif edit_type == "add_method":
-                lines = _apply_add_method(lines, edit.get("target"), edit.get("details", {}))
-            elif edit_type == "remove_method":
-                lines = _apply_remove_method(lines, edit.get("target"), edit.get("details", {}))
-            elif edit_type == "modify_method":
-                lines = _apply_modify_method(lines, edit.get("target"), edit.get("details", {}))
-            elif edit_type == "add_participant":
-                lines = _apply_add_participant(lines, edit.get("details", {}))
-            elif edit_type == "remove_participant":
-                lines = _apply_remove_participant(lines, edit.get("target"))
-            elif edit_type == "add_message":
-                lines = _apply_add_message(lines, edit.get("details", {}))
-            elif edit_type == "remove_message":
-                lines = _apply_remove_message(lines, edit.get("details", {}))
-            elif edit_type == "add_state":
-                lines = _apply_add_state(lines, edit.get("details", {}))
-            elif edit_type == "remove_state":
-                lines = _apply_remove_state(lines, edit.get("target"))
-            elif edit_type == "add_transition":
-                lines = _apply_add_transition(lines, edit.get("details", {}))
-            elif edit_type == "remove_transition":
-                lines = _apply_remove_transition(lines, edit.get("details", {}))
-            elif edit_type == "add_note":
-                lines = _apply_add_note(lines, edit.get("details", {}))
-            elif edit_type == "remove_note":
-                lines = _apply_remove_note(lines, edit.get("details", {}))
-            elif edit_type == "modify_note":
-                lines = _apply_modify_note(lines, edit.get("details", {}))
-            else:
-                logger.warning(f"Unknown edit type: {edit_type}")
-        except Exception as e:
-            logger.error(f"Error applying edit {edit_type}: {e}", exc_info=True)
+        # Repeating an idempotent edit back to back is a duplicate from the model; other
+        # repeats (e.g. the same message sent twice in a polling loop) are real changes
+        if edit == previous and _is_idempotent(edit):
+            logger.warning(f"Skipping repeated {edit_type} edit")
+            continue
+        previous = edit
+        if edit_type not in _DISPATCH:
+            logger.warning(f"Unknown edit type: {edit_type}")
+            continue
+        missing = [path for path in _REQUIRED[edit_type] if not _dig(edit, path)]
+        if missing:
+            logger.warning(f"Skipping {edit_type} edit missing {', '.join(missing)}")
+            continue
+        yield edit
 
-    
-    return '\n'.join(lines)
+
+def _is_idempotent(edit: dict) -> bool:
+    """Whether applying the edit a second time right after the first changes nothing."""
+    if edit["type"] == "modify_note":
+        return True
+    # A pure rename finds nothing left to rename on the second pass
+    details = edit.get("details") or {}
+    return edit["type"] == "modify_class" and set(details) <= {"new_name"}
+
+
+def _dig(edit: dict, path: str):
+    """Look up a dotted path such as "details.name" in an edit, or None if absent."""
+    value = edit
+    for key in path.split('.'):
+        if not isinstance(value, dict):
+            return None
+        value = value.get(key)
+    return value
 
 
-def _detect_diagram_type(lines: list) -> str:
-    """Detect the type of Mermaid diagram from its lines."""
-    for line in lines:
-        line_lower = line.strip().lower()
+def _detect_diagram_type(stripped_lines: list) -> Tuple[str, int]:
+    """Detect the type of Mermaid diagram and the index of its header line (-1 if none)."""
+    for i, line in enumerate(stripped_lines):
+        line_lower = line.lower()
         if line_lower.startswith('classdiagram'):
-            return 'class'
+            return 'class', i
         elif line_lower.startswith('sequencediagram'):
-            return 'sequence'
+            return 'sequence', i
         elif line_lower.startswith('statediagram'):
-            return 'state'
+            return 'state', i
         elif line_lower.startswith('flowchart'):
-            return 'flowchart'
+            return 'flowchart', i
         elif line_lower.startswith('gantt'):
-            return 'gantt'
-    return 'unknown'
+            return 'gantt', i
+    return 'unknown', -1
 
 
-def _find_class_definition(lines: list, class_name: str) -> int:
-    """Find the line index where a class is defined. Returns -1 if not found."""
-    for i, line in enumerate(lines):
-        stripped = line.strip()
-
-        if re.match(rf'^class\s+{re.escape(class_name)}\s*$', stripped, re.IGNORECASE) or \
-           re.match(rf'^class\s+"{re.escape(class_name)}"\s*$', stripped):
-            return i
-    return -1
-
-
-def _find_class_attributes_start(lines: list, class_name: str, class_line_idx: int) -> int:
+def _find_class_attributes_start(stripped_lines: list, class_name: str, class_line_idx: int) -> int:
     """Find where attributes for a class start (colon syntax)."""
-    for i in range(class_line_idx + 1, len(lines)):
-        line = lines[i].strip()
-        if re.match(rf'^{re.escape(class_name)}\s*:\s*[+\-#~]', line):
+    attr_re = _class_attr_re(class_name)
+    for i in range(class_line_idx + 1, len(stripped_lines)):
+        line = stripped_lines[i]
+        if ':' in line and attr_re.match(line):
             return i
-        if line.startswith('class ') or re.match(r'^[A-Za-z_][A-Za-z0-9_]*\s*(<|--|\.\.|o--|\*--)', line):
+        if line.startswith('class ') or _is_relationship_line(line):
             break
     return -1
 
 
-def _find_class_attributes_end(lines: list, class_name: str, start_idx: int) -> int:
+def _find_class_attributes_end(stripped_lines: list, class_name: str, start_idx: int) -> int:
     """Find where attributes for a class end."""
-    for i in range(start_idx, len(lines)):
-        line = lines[i].strip()
-        if not re.match(rf'^{re.escape(class_name)}\s*:\s*', line):
+    member_re = _class_member_re(class_name)
+    for i in range(start_idx, len(stripped_lines)):
+        line = stripped_lines[i]
+        if not line.startswith(class_name) or not member_re.match(line):
             return i
-    return len(lines)
+    return len(stripped_lines)
 
 
-def _apply_add_class(lines: list, details: dict) -> list:
+def _apply_add_class(index: _DiagramIndex, class_name: str, details: dict) -> None:
     """Add a new class to the diagram."""
-    class_name = details.get("name")
-    if not class_name:
-        return lines
-    
+    lines = index.lines
+    stripped = index.stripped
     attributes = details.get("attributes", [])
     methods = details.get("methods", [])
     position = details.get("position", "end")
@@ -156,543 +479,393 @@ def _apply_add_class(lines: list, details: dict) -> list:
     if position == "end":
 
         insert_idx = len(lines)
-        for i in range(len(lines) - 1, -1, -1):
-            if lines[i].strip().startswith('class '):
-
-                existing_class_name = lines[i].strip().split()[1] if len(lines[i].strip().split()) > 1 else ""
-                insert_idx = i + 1
-                while insert_idx < len(lines) and \
-                      (lines[insert_idx].strip().startswith(existing_class_name + ' :') or 
-                       lines[insert_idx].strip() == ''):
-                    insert_idx += 1
-                break
+        if index.class_starts:
+            i = index.class_starts[-1]
+            parts = stripped[i].split()
+            existing_class_name = parts[1] if len(parts) > 1 else ""
+            insert_idx = i + 1
+            while insert_idx < len(lines) and \
+                  (stripped[insert_idx].startswith(existing_class_name + ' :') or 
+                   stripped[insert_idx] == ''):
+                insert_idx += 1
     elif position.startswith("after:"):
         after_class = position.split(":", 1)[1]
-        idx = _find_class_definition(lines, after_class)
+        idx = index.find_class(after_class)
         if idx >= 0:
 
             insert_idx = idx + 1
             while insert_idx < len(lines) and \
-                  (lines[insert_idx].strip().startswith(after_class + ' :') or 
-                   lines[insert_idx].strip() == ''):
+                  (stripped[insert_idx].startswith(after_class + ' :') or 
+                   stripped[insert_idx] == ''):
                 insert_idx += 1
         else:
             insert_idx = len(lines)
     elif position.startswith("before:"):
         before_class = position.split(":", 1)[1]
-        insert_idx = _find_class_definition(lines, before_class)
+        insert_idx = index.find_class(before_class)
         if insert_idx < 0:
             insert_idx = len(lines)
     else:
         insert_idx = len(lines)
     
 
-    lines[insert_idx:insert_idx] = new_lines
-    return lines
+    index.insert(insert_idx, new_lines)
 
 
-def _apply_remove_class(lines: list, class_name: str) -> list:
-    """Remove a class and all its attributes/methods and relationships."""
-    class_idx = _find_class_definition(lines, class_name)
-    if class_idx < 0:
-        return lines
+def _apply_remove_classes(index: _DiagramIndex, class_names: list) -> None:
+    """Remove classes with all their attributes/methods, relationships and notes."""
+    targets = [name for name in class_names if index.find_class(name) >= 0]
+    if not targets:
+        return
     
+    lines = index.lines
+    stripped = index.stripped
 
-    indices_to_remove = [class_idx]
-    
-
-    for i in range(class_idx + 1, len(lines)):
-        line = lines[i].strip()
-        if line.startswith(f"{class_name} :"):
-            indices_to_remove.append(i)
-        elif line.startswith('class ') or re.match(r'^[A-Za-z_][A-Za-z0-9_]*\s*(<|--|\.\.|o--|\*--)', line):
-            break
-    
-
-    for i in range(len(lines) - 1, -1, -1):
-        if i in indices_to_remove:
-            continue
-        line = lines[i].strip()
-
-        if re.search(rf'\b{re.escape(class_name)}\b', line) and \
-           re.search(r'(<|--|\.\.|o--|\*--)', line):
-            indices_to_remove.append(i)
-    
-
-    for i in range(len(lines) - 1, -1, -1):
-        if i in indices_to_remove:
+    # One pass over the relationship and note lines attributes each to the
+    # targets it mentions: notes by substring, relationships by whole word
+    # (a note that is also a relationship line is covered by the substring test)
+    mentions = {name: [] for name in targets}
+    names_re = _words_re(tuple(targets))
+    for i in set(index.relationships).union(index.notes):
+        line = stripped[i]
+        if line.startswith('note '):
+            found = [name for name in targets if name in line]
+        else:
+            found = set(names_re.findall(line))
+        for name in found:
+            mentions[name].append(i)
+
+    # Lines already claimed by an earlier target count as gone for later ones,
+    # so a target resolves to its first definition not yet removed (names that
+    # differ only in case share a class_line slot)
+    remove_set = set()
+    for class_name in targets:
+        candidates = [i for i in index.class_line.get(class_name.lower(), []) +
+                      index.quoted_class_line.get(class_name, []) if i not in remove_set]
+        if not candidates:
             continue
-        line = lines[i].strip()
-        if line.startswith('note ') and class_name in line:
-            indices_to_remove.append(i)
+        class_idx = min(candidates)
+        remove_set.add(class_idx)
+        for i in range(class_idx + 1, len(lines)):
+            if i in remove_set:
+                continue
+            line = stripped[i]
+            if line.startswith(f"{class_name} :"):
+                remove_set.add(i)
+            elif line.startswith('class ') or _is_relationship_line(line):
+                break
+        remove_set.update(mentions[class_name])
 
-    for idx in sorted(indices_to_remove, reverse=True):
-        lines.pop(idx)
-    
-    return lines
+    index.remove(remove_set)
 
 
-def _apply_modify_class(lines: list, class_name: str, details: dict) -> list:
+def _apply_modify_class(index: _DiagramIndex, class_name: str, details: dict) -> None:
     """Modify an existing class."""
-    class_idx = _find_class_definition(lines, class_name)
+    class_idx = index.find_class(class_name)
     if class_idx < 0:
-        return lines
+        return
     
+    lines = index.lines
 
     new_name = details.get("new_name")
     if new_name and new_name != class_name:
 
-        lines[class_idx] = lines[class_idx].replace(f"class {class_name}", f"class {new_name}")
-        for i in range(class_idx + 1, len(lines)):
-            if lines[i].strip().startswith(f"{class_name} :"):
-                lines[i] = lines[i].replace(f"{class_name} :", f"{new_name} :")
-            elif lines[i].strip().startswith('class ') or \
-                 re.match(r'^[A-Za-z_][A-Za-z0-9_]*\s*(<|--|\.\.|o--|\*--)', lines[i].strip()):
-                break
-
+        # Covers the class line, its members, relationships and notes alike
+        name_re = _word_re(class_name)
         for i in range(len(lines)):
-            lines[i] = re.sub(rf'\b{re.escape(class_name)}\b', new_name, lines[i])
+            if class_name in lines[i]:
+                index.replace(i, name_re.sub(new_name, lines[i]))
         class_name = new_name
     
 
-    attr_start = _find_class_attributes_start(lines, class_name, class_idx)
-    if attr_start < 0:
-        attr_start = class_idx + 1
-    
-    attr_end = _find_class_attributes_end(lines, class_name, attr_start)
-    
-
-    remove_attrs = details.get("remove_attributes", [])
-    add_attrs = details.get("add_attributes", [])
-    modify_attrs = details.get("modify_attributes", [])
-    
+    # Attributes go first, so method requests also see attributes added by this edit
+    add_attributes = details.get("add_attributes", []) if details.get("position", "end") == "end" else []
+    _modify_members(index, class_name, class_idx, details.get("remove_attributes", []),
+                    details.get("modify_attributes", []), add_attributes)
+    _modify_members(index, class_name, class_idx, details.get("remove_methods", []),
+                    details.get("modify_methods", []), details.get("add_methods", []))
 
-    for attr_name in remove_attrs:
-        for i in range(attr_end - 1, attr_start - 1, -1):
-            if attr_name in lines[i] and lines[i].strip().startswith(f"{class_name} :"):
-                lines.pop(i)
-                attr_end -= 1
-                break
-    
 
-    for mod in modify_attrs:
-        old_attr = mod.get("old", "")
-        new_attr = mod.get("new", "")
-        for i in range(attr_start, attr_end):
-            if old_attr in lines[i]:
-                lines[i] = lines[i].replace(old_attr, new_attr)
-                break
-    
-
-    position = details.get("position", "end")
-    for attr in add_attrs:
-        if position == "end":
-            lines.insert(attr_end, f"{class_name} : {attr}")
-            attr_end += 1
-
-    remove_methods = details.get("remove_methods", [])
-    add_methods = details.get("add_methods", [])
-    modify_methods = details.get("modify_methods", [])
-    
-
-    attr_start = _find_class_attributes_start(lines, class_name, class_idx)
+def _modify_members(index: _DiagramIndex, class_name: str, class_idx: int,
+                    removals: list, modifications: list, additions: list) -> None:
+    """
+    Remove, then rewrite, then append colon-syntax members of a class. A reverse
+    pass picks the lines to remove and a forward pass rewrites the rest; each
+    request takes the nearest matching line in its scan direction, as if applied
+    one by one.
+    """
+    lines = index.lines
+    stripped = index.stripped
+    attr_start, attr_end = index.member_range(class_name, class_idx)
     if attr_start < 0:
         attr_start = class_idx + 1
-    attr_end = _find_class_attributes_end(lines, class_name, attr_start)
-    
 
-    for method_name in remove_methods:
-        for i in range(attr_end - 1, attr_start - 1, -1):
-            if method_name in lines[i] and lines[i].strip().startswith(f"{class_name} :"):
-                lines.pop(i)
-                attr_end -= 1
-                break
-    
+    pending_removals = list(removals)
+    member_prefix = f"{class_name} :"
+    remove_set = set()
+    for i in range(attr_end - 1, attr_start - 1, -1):
+        if not pending_removals:
+            break
+        if stripped[i].startswith(member_prefix):
+            name = next((name for name in pending_removals if name in lines[i]), None)
+            if name is not None:
+                remove_set.add(i)
+                pending_removals.remove(name)
 
-    for mod in modify_methods:
-        old_method = mod.get("old", "")
-        new_method = mod.get("new", "")
-        for i in range(attr_start, attr_end):
-            if old_method in lines[i]:
-                lines[i] = lines[i].replace(old_method, new_method)
-                break
-    
+    pending_mods = [(mod.get("old", ""), mod.get("new", "")) for mod in modifications]
+    for i in range(attr_start, attr_end):
+        if not pending_mods:
+            break
+        if i in remove_set:
+            continue
+        line = lines[i]
+        for mod in list(pending_mods):
+            if mod[0] in line:
+                line = line.replace(*mod)
+                pending_mods.remove(mod)
+        index.replace(i, line)
 
-    for method in add_methods:
-        lines.insert(attr_end, f"{class_name} : {method}")
-        attr_end += 1
-    
-    return lines
+    index.remove(remove_set)
+    if additions:
+        index.insert(attr_end - len(remove_set), [f"{class_name} : {member}" for member in additions])
 
 
-def _apply_add_relationship(lines: list, details: dict) -> list:
+def _apply_add_relationship(index: _DiagramIndex, from_class: str, to_class: str, details: dict) -> None:
     """Add a relationship between classes."""
-    from_class = details.get("from")
-    to_class = details.get("to")
     rel_type = details.get("type", "-->")
     label = details.get("label", "")
     mult_from = details.get("multiplicity_from")
     mult_to = details.get("multiplicity_to")
     
-    if not from_class or not to_class:
-        return lines
-    
 
-    if mult_from and mult_to:
-        rel_line = f'{from_class} "{mult_from}" {rel_type} "{mult_to}" {to_class}'
-    elif mult_from:
-        rel_line = f'{from_class} "{mult_from}" {rel_type} {to_class}'
-    elif mult_to:
-        rel_line = f'{from_class} {rel_type} "{mult_to}" {to_class}'
-    else:
-        rel_line = f'{from_class} {rel_type} {to_class}'
-    
-    if label:
-        rel_line += f' : {label}'
+    rel_line = _format_relationship(from_class, rel_type, to_class, mult_from, mult_to, label)
     
 
-    insert_idx = len(lines)
-    for i in range(len(lines) - 1, -1, -1):
-        line = lines[i].strip()
-        if line.startswith('note '):
-            insert_idx = i
-        elif re.match(r'^[A-Za-z_][A-Za-z0-9_]*\s*(<|--|\.\.|o--|\*--)', line):
+    # After the last relationship line, otherwise before the first note
+    lines = index.lines
+    stripped = index.stripped
+    insert_idx = index.notes[0] if index.notes else len(lines)
+    for i in reversed(index.relationships):
+        line = stripped[i]
+        if not line.startswith('note ') and _is_relationship_line(line):
             insert_idx = i + 1
             break
     
-    lines.insert(insert_idx, rel_line)
-    return lines
+    index.insert(insert_idx, [rel_line])
 
 
-def _apply_remove_relationship(lines: list, details: dict) -> list:
+def _apply_remove_relationship(index: _DiagramIndex, from_class: str, to_class: str, details: dict) -> None:
     """Remove a relationship between classes."""
-    from_class = details.get("from")
-    to_class = details.get("to")
     rel_type = details.get("type")
     
-    if not from_class or not to_class:
-        return lines
-    
 
-    for i in range(len(lines) - 1, -1, -1):
-        line = lines[i].strip()
-        if from_class in line and to_class in line and \
-           (rel_type is None or rel_type in line) and \
-           re.search(r'(<|--|\.\.|o--|\*--)', line):
-            lines.pop(i)
+    for i, rel in zip(reversed(index.relationships), reversed(index.relationship_records)):
+        if _connects(rel, from_class, to_class) and \
+           (rel_type is None or rel_type in index.stripped[i]):
+            index.pop(i)
             break
-    
-    return lines
 
 
-def _apply_modify_relationship(lines: list, details: dict) -> list:
+def _apply_modify_relationship(index: _DiagramIndex, from_class: str, to_class: str, details: dict) -> None:
     """Modify an existing relationship."""
-    from_class = details.get("from")
-    to_class = details.get("to")
     old_type = details.get("old_type")
     new_type = details.get("new_type")
     new_label = details.get("new_label")
     new_mult_from = details.get("new_multiplicity_from")
     new_mult_to = details.get("new_multiplicity_to")
     
-    if not from_class or not to_class:
-        return lines
-    
 
-    for i, line in enumerate(lines):
-        if from_class in line and to_class in line and \
-           (old_type is None or old_type in line) and \
-           re.search(r'(<|--|\.\.|o--|\*--)', line):
-            if new_mult_from and new_mult_to:
-                new_line = f'{from_class} "{new_mult_from}" {new_type} "{new_mult_to}" {to_class}'
-            elif new_mult_from:
-                new_line = f'{from_class} "{new_mult_from}" {new_type} {to_class}'
-            elif new_mult_to:
-                new_line = f'{from_class} {new_type} "{new_mult_to}" {to_class}'
-            else:
-                if old_type:
-                    new_line = re.sub(rf'{re.escape(old_type)}', new_type, line)
-                else:
-
-                    new_line = re.sub(r'(<\|--|--|\.\.>|o--|\*--)', new_type, line)
-
-                existing_label = None
-                if ' : ' in line:
-                    parts = line.split(' : ', 1)
-                    existing_label = parts[1] if len(parts) > 1 else None
-                    line_without_label = parts[0]
-                else:
-                    line_without_label = line
-
-                mult_match = re.search(rf'{re.escape(from_class)}\s*"([^"]+)"\s*{re.escape(old_type)}\s*"([^"]+)"\s*{re.escape(to_class)}', line_without_label)
-                if mult_match:
-                    new_line = f'{from_class} "{mult_match.group(1)}" {new_type} "{mult_match.group(2)}" {to_class}'
-                else:
-                    mult_match = re.search(rf'{re.escape(from_class)}\s*"([^"]+)"\s*{re.escape(old_type)}\s*{re.escape(to_class)}', line_without_label)
-                    if mult_match:
-                        new_line = f'{from_class} "{mult_match.group(1)}" {new_type} {to_class}'
-                    else:
-                        mult_match = re.search(rf'{re.escape(from_class)}\s*{re.escape(old_type)}\s*"([^"]+)"\s*{re.escape(to_class)}', line_without_label)
-                        if mult_match:
-                            new_line = f'{from_class} {new_type} "{mult_match.group(1)}" {to_class}'
-                        else:
-                            new_line = f'{from_class} {new_type} {to_class}'
-            
-            if new_label:
-                new_line += f' : {new_label}'
-            elif existing_label:
-                new_line += f' : {existing_label}'
-            
-            lines[i] = new_line
+    for i, rel in zip(index.relationships, index.relationship_records):
+        if _connects(rel, from_class, to_class) and \
+           (old_type is None or old_type in index.lines[i]):
+            # Fields not being changed are carried over from the parsed line. The line
+            # is rewritten in the edit's direction, so a match written the other way
+            # round has its multiplicities swapped and its arrow mirrored.
+            if rel.from_ == to_class and rel.to == from_class and from_class != to_class:
+                rel = rel._replace(type_=_mirror_rel_type(rel.type_), mult_from=rel.mult_to, mult_to=rel.mult_from)
+            new_line = _format_relationship(
+                from_class,
+                new_type or rel.type_,
+                to_class,
+                new_mult_from or rel.mult_from,
+                new_mult_to or rel.mult_to,
+                new_label or rel.label,
+            )
+            index.replace(i, new_line)
             break
-    
-    return lines
 
 
-def _apply_add_attribute(lines: list, class_name: str, details: dict) -> list:
+def _strip_class_prefix(member: str, class_name: str) -> str:
+    """Drop a leading "ClassName :" the model sometimes copies into a member string."""
+    stripped = member.strip()
+    for prefix in (f"{class_name} :", f"{class_name}:"):
+        if stripped.startswith(prefix):
+            return stripped[len(prefix):].strip()
+    return member
+
+
+def _apply_add_attribute(index: _DiagramIndex, class_name: str, attribute: str) -> None:
     """Add an attribute to a class."""
-    attribute = details.get("attribute")
-    if not attribute:
-        return lines
-    
     # Sanitize attribute to remove potential class prefix
-    if attribute.strip().startswith(f"{class_name} :"):
-        attribute = attribute.strip()[len(f"{class_name} :"):].strip()
-    elif attribute.strip().startswith(f"{class_name}:"):
-        attribute = attribute.strip()[len(f"{class_name}:"):].strip()
+    attribute = _strip_class_prefix(attribute, class_name)
     
-    class_idx = _find_class_definition(lines, class_name)
+    class_idx = index.find_class(class_name)
     if class_idx < 0:
-        return lines
+        return
     
-    attr_start = _find_class_attributes_start(lines, class_name, class_idx)
+    attr_start, attr_end = index.member_range(class_name, class_idx)
     if attr_start < 0:
         attr_start = class_idx + 1
     
-    attr_end = _find_class_attributes_end(lines, class_name, attr_start)
-    
     new_line = f"{class_name} : {attribute}"
-    lines.insert(attr_end, new_line)
-    return lines
+    index.insert(attr_end, [new_line])
 
 
-def _apply_remove_attribute(lines: list, class_name: str, details: dict) -> list:
+def _apply_remove_attribute(index: _DiagramIndex, class_name: str, attribute: str) -> None:
     """Remove an attribute from a class."""
-    attribute = details.get("attribute")
-    if not attribute:
-        return lines
-    
-    class_idx = _find_class_definition(lines, class_name)
+    class_idx = index.find_class(class_name)
     if class_idx < 0:
-        return lines
+        return
     
-    attr_start = _find_class_attributes_start(lines, class_name, class_idx)
+    lines = index.lines
+    stripped = index.stripped
+    attr_start, attr_end = index.member_range(class_name, class_idx)
     if attr_start < 0:
-        return lines
-    
-    attr_end = _find_class_attributes_end(lines, class_name, attr_start)
+        return
     
     # Find and remove exact match
     for i in range(attr_end - 1, attr_start - 1, -1):
-        if attribute in lines[i] and lines[i].strip().startswith(f"{class_name} :"):
-            lines.pop(i)
+        if attribute in lines[i] and stripped[i].startswith(f"{class_name} :"):
+            index.pop(i)
             break
-    
-    return lines
 
 
-def _apply_modify_attribute(lines: list, class_name: str, details: dict) -> list:
+def _apply_modify_attribute(index: _DiagramIndex, class_name: str, old_attr: str, new_attr: str) -> None:
     """Modify an attribute in a class."""
-    old_attr = details.get("old")
-    new_attr = details.get("new")
-    if not old_attr or not new_attr:
-        return lines
-        
     # Sanitize new_attr to remove potential class prefix
-    if new_attr.strip().startswith(f"{class_name} :"):
-        new_attr = new_attr.strip()[len(f"{class_name} :"):].strip()
-    elif new_attr.strip().startswith(f"{class_name}:"):
-        new_attr = new_attr.strip()[len(f"{class_name}:"):].strip()
+    new_attr = _strip_class_prefix(new_attr, class_name)
     
-    class_idx = _find_class_definition(lines, class_name)
+    class_idx = index.find_class(class_name)
     if class_idx < 0:
-        return lines
+        return
     
-    attr_start = _find_class_attributes_start(lines, class_name, class_idx)
+    lines = index.lines
+    attr_start, attr_end = index.member_range(class_name, class_idx)
     if attr_start < 0:
-        return lines
-    
-    attr_end = _find_class_attributes_end(lines, class_name, attr_start)
+        return
     
     for i in range(attr_start, attr_end):
         if old_attr in lines[i]:
-            lines[i] = lines[i].replace(old_attr, new_attr)
+            index.replace(i, lines[i].replace(old_attr, new_attr))
             break
-    
-    return lines
 
 
-def _apply_add_method(lines: list, class_name: str, details: dict) -> list:
+def _apply_add_method(index: _DiagramIndex, class_name: str, method: str) -> None:
     """Add a method to a class."""
-    method = details.get("method")
-    if not method:
-        return lines
-        
     # Sanitize method to remove potential class prefix
-    if method.strip().startswith(f"{class_name} :"):
-        method = method.strip()[len(f"{class_name} :"):].strip()
-    elif method.strip().startswith(f"{class_name}:"):
-        method = method.strip()[len(f"{class_name}:"):].strip()
+    method = _strip_class_prefix(method, class_name)
     
-    class_idx = _find_class_definition(lines, class_name)
+    class_idx = index.find_class(class_name)
     if class_idx < 0:
-        return lines
+        return
     
-    attr_start = _find_class_attributes_start(lines, class_name, class_idx)
+    attr_start, attr_end = index.member_range(class_name, class_idx)
     if attr_start < 0:
         attr_start = class_idx + 1
     
-    attr_end = _find_class_attributes_end(lines, class_name, attr_start)
-    
     new_line = f"{class_name} : {method}"
-    lines.insert(attr_end, new_line)
-    return lines
+    index.insert(attr_end, [new_line])
 
 
-def _apply_remove_method(lines: list, class_name: str, details: dict) -> list:
+def _apply_remove_method(index: _DiagramIndex, class_name: str, method: str) -> None:
     """Remove a method from a class."""
-    method = details.get("method")
-    if not method:
-        return lines
-    
-    class_idx = _find_class_definition(lines, class_name)
+    class_idx = index.find_class(class_name)
     if class_idx < 0:
-        return lines
+        return
     
-    attr_start = _find_class_attributes_start(lines, class_name, class_idx)
+    lines = index.lines
+    stripped = index.stripped
+    attr_start, attr_end = index.member_range(class_name, class_idx)
     if attr_start < 0:
-        return lines
-    
-    attr_end = _find_class_attributes_end(lines, class_name, attr_start)
+        return
     
     for i in range(attr_end - 1, attr_start - 1, -1):
-        if method in lines[i] and lines[i].strip().startswith(f"{class_name} :"):
-            lines.pop(i)
+        if method in lines[i] and stripped[i].startswith(f"{class_name} :"):
+            index.pop(i)
             break
-    
-    return lines
 
 
-def _apply_modify_method(lines: list, class_name: str, details: dict) -> list:
+def _apply_modify_method(index: _DiagramIndex, class_name: str, old_method: str, new_method: str) -> None:
     """Modify a method in a class."""
-    old_method = details.get("old")
-    new_method = details.get("new")
-    if not old_method or not new_method:
-        return lines
-        
     # Sanitize new_method to remove potential class prefix
-    if new_method.strip().startswith(f"{class_name} :"):
-        new_method = new_method.strip()[len(f"{class_name} :"):].strip()
-    elif new_method.strip().startswith(f"{class_name}:"):
-        new_method = new_method.strip()[len(f"{class_name}:"):].strip()
+    new_method = _strip_class_prefix(new_method, class_name)
     
-    class_idx = _find_class_definition(lines, class_name)
+    class_idx = index.find_class(class_name)
     if class_idx < 0:
-        return lines
+        return
     
-    attr_start = _find_class_attributes_start(lines, class_name, class_idx)
+    lines = index.lines
+    attr_start, attr_end = index.member_range(class_name, class_idx)
     if attr_start < 0:
-        return lines
-    
-    attr_end = _find_class_attributes_end(lines, class_name, attr_start)
+        return
     
     for i in range(attr_start, attr_end):
         if old_method in lines[i]:
-            lines[i] = lines[i].replace(old_method, new_method)
+            index.replace(i, lines[i].replace(old_method, new_method))
             break
-    
-    return lines
 
 
-def _apply_add_participant(lines: list, details: dict) -> list:
+def _apply_add_participant(index: _DiagramIndex, name: str) -> None:
     """Add a participant to a sequence diagram."""
-    name = details.get("name")
-    if not name:
-        return lines
-    
-    # Find where participants are defined
-    insert_idx = 1  # After sequenceDiagram line
-    for i, line in enumerate(lines):
-        if line.strip().startswith('sequenceDiagram'):
-            insert_idx = i + 1
-            # Find end of participant definitions
-            for j in range(i + 1, len(lines)):
-                if not lines[j].strip().startswith('participant '):
-                    insert_idx = j
-                    break
-            break
+    # After the run of participant definitions that follows the header
+    insert_idx = index.header[0] + 1 if index.header else 1
+    participants = index.participants
+    k = bisect_left(participants, insert_idx)
+    while k < len(participants) and participants[k] == insert_idx:
+        insert_idx += 1
+        k += 1
     
-    lines.insert(insert_idx, f"participant {name}")
-    return lines
+    index.insert(insert_idx, [f"participant {name}"])
 
 
-def _apply_remove_participant(lines: list, participant_name: str) -> list:
+def _apply_remove_participant(index: _DiagramIndex, participant_name: str) -> None:
     """Remove a participant and all its messages."""
-    # Remove participant definition - handle both quoted and unquoted names
-    for i in range(len(lines) - 1, -1, -1):
-        line = lines[i].strip()
-        # Match: participant "NLP Extractor" or participant NLP_Extractor
-        if line.startswith('participant '):
-            # Extract the participant name from the line (handle quotes)
-            parts = line.split('participant ', 1)
-            if len(parts) > 1:
-                name_in_line = parts[1].strip().strip('"').strip("'")
-                if name_in_line == participant_name or participant_name in line:
-                    lines.pop(i)
-                    break
-    
-    # Remove messages involving this participant
-    # Match participant name in message lines (handle quotes)
-    quoted_name = f'"{participant_name}"'
-    for i in range(len(lines) - 1, -1, -1):
-        line = lines[i].strip()
-        if re.search(r'(->>|-->>|->|-->)', line):
-            # Check if participant name (quoted or unquoted) appears in the message line
-            # Split by : to get the participant part (before the message text)
-            if ':' in line:
-                participant_part = line.split(':', 1)[0]
-            else:
-                participant_part = line
-            
-            # Check if quoted or unquoted name appears in participant part
-            if quoted_name in participant_part or participant_name in participant_part:
-                lines.pop(i)
-    
-    # Remove activate/deactivate lines for this participant
+    lines = index.lines
+    stripped = index.stripped
+    unquoted_name = participant_name.strip('"')
+    message_records = dict(zip(index.messages, index.message_records))
+    remove_set = set()
+    definition_found = False
+
+    # One reverse scan marks the participant definition, its messages and
+    # its activate/deactivate lines; they are dropped together afterwards
     for i in range(len(lines) - 1, -1, -1):
-        line = lines[i].strip()
+        line = stripped[i]
+        if not definition_found and line.startswith('participant '):
+            # Match: participant "NLP Extractor" or participant NLP_Extractor
+            name_in_line = line.split('participant ', 1)[1].strip().strip('"').strip("'")
+            if name_in_line == participant_name or participant_name in line:
+                remove_set.add(i)
+                definition_found = True
+                continue
+
+        msg = message_records.get(i)
+        if msg is not None and unquoted_name in (msg.from_, msg.to):
+            remove_set.add(i)
         if line.startswith('activate ') or line.startswith('deactivate '):
-            # Extract the participant name from activate/deactivate line
-            parts = line.split(' ', 1)
-            if len(parts) > 1:
-                name_in_line = parts[1].strip().strip('"').strip("'")
-                if name_in_line == participant_name:
-                    lines.pop(i)
-    
-    return lines
+            name_in_line = line.split(' ', 1)[1].strip().strip('"').strip("'")
+            if name_in_line == participant_name:
+                remove_set.add(i)
 
+    index.remove(remove_set)
 
-def _apply_add_message(lines: list, details: dict) -> list:
+
+def _apply_add_message(index: _DiagramIndex, from_participant: str, to_participant: str, details: dict) -> None:
     """Add a message to a sequence diagram."""
-    from_participant = details.get("from")
-    to_participant = details.get("to")
     message = details.get("message", "")
     msg_type = details.get("type", "->>")
     position = details.get("position", "end")
     
-    if not from_participant or not to_participant:
-        return lines
-    
     # Handle newlines in message - Mermaid doesn't support \n in message labels
     # Replace \n with space or keep as single line
     # For multi-line messages, we'll keep them as a single line with the \n as literal text
@@ -711,199 +884,358 @@ def _apply_add_message(lines: list, details: dict) -> list:
     new_line = f"{from_quoted}{msg_type}{to_quoted}: {message_clean}"
     
     # Find insertion point based on position parameter
+    lines = index.lines
     insert_idx = len(lines)
     
     if position.startswith("after:"):
         # Find message containing the specified text
         search_text = position.split(":", 1)[1].strip()
-        for i, line in enumerate(lines):
-            if search_text in line and re.search(r'(->>|-->>|->|-->)', line):
+        for i in index.messages:
+            if search_text in lines[i]:
                 insert_idx = i + 1
                 break
     elif position.startswith("before:"):
         # Find message containing the specified text
         search_text = position.split(":", 1)[1].strip()
-        for i, line in enumerate(lines):
-            if search_text in line and re.search(r'(->>|-->>|->|-->)', line):
+        for i in index.messages:
+            if search_text in lines[i]:
                 insert_idx = i
                 break
-    else:
-        # Default: find last message and insert after it
-        for i in range(len(lines) - 1, -1, -1):
-            line = lines[i].strip()
-            if re.search(r'(->>|-->>|->|-->)', line):
-                insert_idx = i + 1
-                break
+    elif index.messages:
+        # Default: insert after the last message
+        insert_idx = index.messages[-1] + 1
     
-    lines.insert(insert_idx, new_line)
-    return lines
+    index.insert(insert_idx, [new_line])
 
 
-def _apply_remove_message(lines: list, details: dict) -> list:
+def _apply_remove_message(index: _DiagramIndex, from_participant: str, to_participant: str, details: dict) -> None:
     """Remove a message from a sequence diagram."""
-    from_participant = details.get("from")
-    to_participant = details.get("to")
     message = details.get("message")
     
-    if not from_participant or not to_participant:
-        return lines
-    
     # Normalize message for matching (handle newlines)
     if message:
         # Replace \n with actual newline for matching
         message_normalized = message.replace('\\n', '\n')
-        # Also try matching parts of the message
-        message_parts = message_normalized.split('\n')
+        # Also try matching parts of the message, stripped once up front
+        message_parts = [part for part in (p.strip() for p in message_normalized.split('\n')) if part]
     else:
         message_parts = []
     
-    for i in range(len(lines) - 1, -1, -1):
-        line = lines[i].strip()
-        if from_participant in line and to_participant in line and \
-           re.search(r'(->>|-->>|->|-->)', line):
+    from_participant = from_participant.strip('"')
+    to_participant = to_participant.strip('"')
+    for i, msg in zip(reversed(index.messages), reversed(index.message_records)):
+        if msg is not None and msg.from_ == from_participant and msg.to == to_participant:
+            line = msg.text or ''
             if message is None:
                 # Remove any message between these participants
-                lines.pop(i)
+                index.pop(i)
                 break
             else:
                 # Check if message matches (handle newlines and partial matches)
                 line_normalized = line.replace('\\n', '\n')
                 if message_normalized in line_normalized or message in line:
-                    lines.pop(i)
+                    index.pop(i)
                     break
                 # Also try matching if any part of the message is in the line
-                elif message_parts and any(part.strip() in line for part in message_parts if part.strip()):
-                    lines.pop(i)
+                elif any(part in line for part in message_parts):
+                    index.pop(i)
                     break
-    
-    return lines
 
 
-def _apply_add_state(lines: list, details: dict) -> list:
-    """Add a state to a state diagram."""
-    name = details.get("name")
-    parent = details.get("parent")
-    
-    if not name:
-        return lines
-    
-    if parent:
-        # Find parent state block
-        in_parent = False
-        for i, line in enumerate(lines):
-            if f"state {parent}" in line:
-                in_parent = True
-            elif in_parent and line.strip() == "}":
-                lines.insert(i, f"    {name}")
-                break
-    else:
-        # Add at end
-        lines.append(name)
-    
-    return lines
+def _apply_add_states(index: _DiagramIndex, states: List[dict]) -> None:
+    """Add states to a state diagram with one splice per parent block."""
+    # States sharing a parent land next to each other in order, so insert them together
+    names_by_parent: Dict[Optional[str], List[str]] = {}
+    for details in states:
+        names_by_parent.setdefault(details.get("parent") or None, []).append(details["name"])
+
+    for parent, names in names_by_parent.items():
+        if parent:
+            # Find parent state block, then its closing brace
+            stripped = index.stripped
+            for start in index.state_starts:
+                if f"state {parent}" in stripped[start]:
+                    for i in range(start + 1, len(stripped)):
+                        if stripped[i] == "}":
+                            index.insert(i, [f"    {name}" for name in names])
+                            break
+                    break
+        else:
+            # Add at end
+            index.insert(len(index.lines), names)
 
 
-def _apply_remove_state(lines: list, state_name: str) -> list:
+def _apply_remove_state(index: _DiagramIndex, state_name: str) -> None:
     """Remove a state and its transitions."""
-    # Remove state definition
-    for i in range(len(lines) - 1, -1, -1):
-        if state_name in lines[i] and not re.search(r'(->|\[)', lines[i]):
-            lines.pop(i)
+    stripped = index.stripped
+    # Every arrow line naming the state is a transition; those are all indexed as messages
+    remove_set = {i for i in index.messages if state_name in stripped[i]}
+    # The last plain line naming the state is its definition
+    for i in range(len(stripped) - 1, -1, -1):
+        line = stripped[i]
+        if state_name in line and '->' not in line and '[' not in line:
+            remove_set.add(i)
             break
-    
-    # Remove transitions involving this state
-    for i in range(len(lines) - 1, -1, -1):
-        line = lines[i].strip()
-        if state_name in line and re.search(r'->', line):
-            lines.pop(i)
-    
-    return lines
 
+    index.remove(remove_set)
 
-def _apply_add_transition(lines: list, details: dict) -> list:
-    """Add a transition to a state diagram."""
-    from_state = details.get("from")
-    to_state = details.get("to")
-    label = details.get("label", "")
-    
-    if not from_state or not to_state:
-        return lines
-    
-    if label:
-        new_line = f"{from_state} --> {to_state} : {label}"
-    else:
-        new_line = f"{from_state} --> {to_state}"
+
+def _apply_add_transitions(index: _DiagramIndex, transitions: List[dict]) -> None:
+    """Add transitions to a state diagram with a single splice."""
+    new_lines = []
+    for details in transitions:
+        label = details.get("label", "")
+        if label:
+            new_lines.append(f"{details['from']} --> {details['to']} : {label}")
+        else:
+            new_lines.append(f"{details['from']} --> {details['to']}")
     
-    # Find insertion point
-    insert_idx = len(lines)
-    for i in range(len(lines) - 1, -1, -1):
-        if re.search(r'-->', lines[i]):
+    # Insert after the last transition; each new one follows the one before it
+    insert_idx = len(index.lines)
+    for i in reversed(index.messages):
+        if '-->' in index.stripped[i]:
             insert_idx = i + 1
             break
     
-    lines.insert(insert_idx, new_line)
-    return lines
+    index.insert(insert_idx, new_lines)
 
 
-def _apply_remove_transition(lines: list, details: dict) -> list:
+def _apply_remove_transition(index: _DiagramIndex, from_state: str, to_state: str) -> None:
     """Remove a transition from a state diagram."""
-    from_state = details.get("from")
-    to_state = details.get("to")
-    
-    if not from_state or not to_state:
-        return lines
-    
-    for i in range(len(lines) - 1, -1, -1):
-        line = lines[i].strip()
+    stripped = index.stripped
+    for i in reversed(index.messages):
+        line = stripped[i]
         if from_state in line and to_state in line and '-->' in line:
-            lines.pop(i)
+            index.pop(i)
             break
-    
-    return lines
 
 
-def _apply_add_note(lines: list, details: dict) -> list:
+def _apply_add_note(index: _DiagramIndex, target: str, text: str) -> None:
     """Add a note to the diagram."""
-    target = details.get("target")
-    text = details.get("text", "")
-    
-    if not target or not text:
-        return lines
-    
     new_line = f'note for {target} "{text}"'
-    lines.append(new_line)
-    return lines
+    index.insert(len(index.lines), [new_line])
 
 
-def _apply_remove_note(lines: list, details: dict) -> list:
+def _apply_remove_note(index: _DiagramIndex, target: str) -> None:
     """Remove a note from the diagram."""
-    target = details.get("target")
-    
-    if not target:
-        return lines
-    
-    for i in range(len(lines) - 1, -1, -1):
-        if lines[i].strip().startswith('note ') and target in lines[i]:
-            lines.pop(i)
+    for i in reversed(index.notes):
+        if target in index.lines[i]:
+            index.pop(i)
             break
-    
-    return lines
 
 
-def _apply_modify_note(lines: list, details: dict) -> list:
+def _apply_modify_note(index: _DiagramIndex, target: str, new_text: str) -> None:
     """Modify an existing note."""
-    target = details.get("target")
-    new_text = details.get("new_text", "")
-    
-    if not target or not new_text:
-        return lines
-    
-    for i, line in enumerate(lines):
-        if line.strip().startswith('note ') and target in line:
-            lines[i] = f'note for {target} "{new_text}"'
+    for i in index.notes:
+        if target in index.lines[i]:
+            index.replace(i, f'note for {target} "{new_text}"')
+            break
+
+
+# Edit type -> handler taking (index, edit). Edits reach these only after
+# _valid_edits has checked the _REQUIRED fields, so they are indexed directly.
+_DISPATCH = {
+    "add_class": lambda index, e: _apply_add_class(index, e["details"]["name"], e["details"]),
+    "remove_class": lambda index, e: _apply_remove_classes(index, [c["target"] for c in e["batch"]]),
+    "modify_class": lambda index, e: _apply_modify_class(index, e["target"], e.get("details") or {}),
+    "add_relationship": lambda index, e: _apply_add_relationship(index, e["details"]["from"], e["details"]["to"], e["details"]),
+    "remove_relationship": lambda index, e: _apply_remove_relationship(index, e["details"]["from"], e["details"]["to"], e["details"]),
+    "modify_relationship": lambda index, e: _apply_modify_relationship(index, e["details"]["from"], e["details"]["to"], e["details"]),
+    "add_attribute": lambda index, e: _apply_add_attribute(index, e["target"], e["details"]["attribute"]),
+    "remove_attribute": lambda index, e: _apply_remove_attribute(index, e["target"], e["details"]["attribute"]),
+    "modify_attribute": lambda index, e: _apply_modify_attribute(index, e["target"], e["details"]["old"], e["details"]["new"]),
+    "add_method": lambda index, e: _apply_add_method(index, e["target"], e["details"]["method"]),
+    "remove_method": lambda index, e: _apply_remove_method(index, e["target"], e["details"]["method"]),
+    "modify_method": lambda index, e: _apply_modify_method(index, e["target"], e["details"]["old"], e["details"]["new"]),
+    "add_participant": lambda index, e: _apply_add_participant(index, e["details"]["name"]),
+    "remove_participant": lambda index, e: _apply_remove_participant(index, e["target"]),
+    "add_message": lambda index, e: _apply_add_message(index, e["details"]["from"], e["details"]["to"], e["details"]),
+    "remove_message": lambda index, e: _apply_remove_message(index, e["details"]["from"], e["details"]["to"], e["details"]),
+    "add_state": lambda index, e: _apply_add_states(index, [s["details"] for s in e["batch"]]),
+    "remove_state": lambda index, e: _apply_remove_state(index, e["target"]),
+    "add_transition": lambda index, e: _apply_add_transitions(index, [t["details"] for t in e["batch"]]),
+    "remove_transition": lambda index, e: _apply_remove_transition(index, e["details"]["from"], e["details"]["to"]),
+    "add_note": lambda index, e: _apply_add_note(index, e["details"]["target"], e["details"]["text"]),
+    "remove_note": lambda index, e: _apply_remove_note(index, e["details"]["target"]),
+    "modify_note": lambda index, e: _apply_modify_note(index, e["details"]["target"], e["details"]["new_text"]),
+}
+
+# Edit types whose consecutive runs reach their handler as one {"type", "batch": [edits]} edit
+_BATCHED = {"remove_class", "add_state", "add_transition"}
+
+# Edit type -> the only diagram type it applies to; edits not listed apply anywhere
+_EDIT_DIAGRAM_TYPES = {
+    **dict.fromkeys(("add_class", "remove_class", "modify_class",
+                     "add_relationship", "remove_relationship", "modify_relationship",
+                     "add_attribute", "remove_attribute", "modify_attribute",
+                     "add_method", "remove_method", "modify_method"), "class"),
+    **dict.fromkeys(("add_participant", "remove_participant", "add_message", "remove_message"), "sequence"),
+    **dict.fromkeys(("add_state", "remove_state", "add_transition", "remove_transition"), "state"),
+}
+
+# Edit type -> fields that must be present and non-empty; handlers rely on these
+_REQUIRED = {
+    "add_class": ("details.name",),
+    "remove_class": ("target",),
+    "modify_class": ("target",),
+    "add_relationship": ("details.from", "details.to"),
+    "remove_relationship": ("details.from", "details.to"),
+    "modify_relationship": ("details.from", "details.to"),
+    "add_attribute": ("target", "details.attribute"),
+    "remove_attribute": ("target", "details.attribute"),
+    "modify_attribute": ("target", "details.old", "details.new"),
+    "add_method": ("target", "details.method"),
+    "remove_method": ("target", "details.method"),
+    "modify_method": ("target", "details.old", "details.new"),
+    "add_participant": ("details.name",),
+    "remove_participant": ("target",),
+    "add_message": ("details.from", "details.to"),
+    "remove_message": ("details.from", "details.to"),
+    "add_state": ("details.name",),
+    "remove_state": ("target",),
+    "add_transition": ("details.from", "details.to"),
+    "remove_transition": ("details.from", "details.to"),
+    "add_note": ("details.target", "details.text"),
+    "remove_note": ("details.target",),
+    "modify_note": ("details.target", "details.new_text"),
+}
+
+
+# Not strict: "details" varies by edit type, which strict mode's closed objects cannot express
+_EDIT_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {"name": "edit_instructions", "schema": EditInstructions.model_json_schema()},
+}
+
+# Shared by every edit call: the system prompt is identical, so one cache key keeps hits together
+_EDIT_PROMPT_CACHE_KEY = "mermaid-edit"
+
+# Results of previous edit requests, keyed on (existing code, normalized prompt), least recent first
+_EDIT_CACHE: "OrderedDict[Tuple[str, str], str]" = OrderedDict()
+_EDIT_CACHE_SIZE = 256
+# Edits run in the endpoint threadpool; OrderedDict reordering is not thread-safe
+_EDIT_CACHE_LOCK = threading.Lock()
+
+
+def _edit_cache_key(user_prompt: str, existing_mermaid_code: str) -> Tuple[str, str]:
+    """Key an edit request on its diagram and its prompt with whitespace collapsed."""
+    # Case is kept: "add class user" and "add class User" produce different diagrams
+    return existing_mermaid_code, ' '.join(user_prompt.split())
+
+
+# Simple single-edit requests that map straight onto an edit, so no LLM call is needed.
+# Only the keywords are case-insensitive; captured names keep the user's casing.
+_NAME = r'([A-Za-z_]\w*)'
+_LOCAL_EDITS = [
+    (re.compile(rf'^(?:remove|delete)\s+(?:the\s+)?(class|state|participant)\s+{_NAME}\.?$', re.IGNORECASE),
+     lambda m: {"type": f"remove_{m[1].lower()}", "target": m[2]}),
+    (re.compile(rf'^add\s+(?:an?\s+)?(class|state|participant)\s+{_NAME}\.?$', re.IGNORECASE),
+     lambda m: {"type": f"add_{m[1].lower()}", "details": {"name": m[2]}}),
+    (re.compile(rf'^rename\s+(?:the\s+)?class\s+{_NAME}\s+to\s+{_NAME}\.?$', re.IGNORECASE),
+     lambda m: {"type": "modify_class", "target": m[1], "details": {"new_name": m[2]}}),
+    (re.compile(rf'^add\s+(?:an?\s+)?transition\s+from\s+{_NAME}\s+to\s+{_NAME}\.?$', re.IGNORECASE),
+     lambda m: {"type": "add_transition", "details": {"from": m[1], "to": m[2]}}),
+    (re.compile(rf'^(?:remove|delete)\s+(?:the\s+)?transition\s+from\s+{_NAME}\s+to\s+{_NAME}\.?$', re.IGNORECASE),
+     lambda m: {"type": "remove_transition", "details": {"from": m[1], "to": m[2]}}),
+]
+
+
+def _local_edit_instructions(user_prompt: str, existing_mermaid_code: str) -> Optional[dict]:
+    """Build edit instructions for a request matching _LOCAL_EDITS, or return None."""
+    prompt = ' '.join(user_prompt.split())
+    for pattern, build in _LOCAL_EDITS:
+        match = pattern.match(prompt)
+        if match:
+            edit = build(match)
+            # Only diagrams of the edit's own type; flowcharts, ER and unknown diagrams go to the LLM
+            stripped_lines = [line.strip() for line in existing_mermaid_code.split('\n')]
+            if _detect_diagram_type(stripped_lines)[0] != _EDIT_DIAGRAM_TYPES.get(edit["type"]):
+                return None
+            # Targets must appear verbatim; anything fuzzier is left to the LLM
+            target = edit.get("target")
+            if target and not _word_re(target).search(existing_mermaid_code):
+                return None
+            return {"edits": [edit]}
+    return None
+
+
+def _remember_edit(key: Tuple[str, str], updated_mermaid_code: str) -> None:
+    """Store an edit result, evicting the least recently used entry when full."""
+    with _EDIT_CACHE_LOCK:
+        _EDIT_CACHE[key] = updated_mermaid_code
+        _EDIT_CACHE.move_to_end(key)
+        if len(_EDIT_CACHE) > _EDIT_CACHE_SIZE:
+            _EDIT_CACHE.popitem(last=False)
+
+
+def _collect_streamed_json(stream) -> SimpleNamespace:
+    """
+    Accumulates a streamed chat completion into a response-shaped object.
+
+    Stops reading as soon as the first top-level JSON object closes, since the
+    edit instructions are that object and nothing after it is used.
+
+    Args:
+        stream: The stream returned by chat.completions.create(stream=True).
+
+    Returns:
+        SimpleNamespace: Object exposing .choices[0].message.content (and
+        .usage when the API reported it) for log_llm_call.
+    """
+    parts = []
+    depth = 0
+    in_string = escaped = closed = False
+    finish_reason = None
+    usage = None
+
+    for chunk in stream:
+        if getattr(chunk, "usage", None):
+            usage = chunk.usage
+        if not chunk.choices:
+            continue
+
+        choice = chunk.choices[0]
+        content = choice.delta.content or ""
+        if choice.finish_reason:
+            finish_reason = choice.finish_reason
+        if not content:
+            continue
+        parts.append(content)
+
+        # Track brace depth across chunk boundaries, ignoring braces inside JSON strings
+        for char in content:
+            if in_string:
+                if escaped:
+                    escaped = False
+                elif char == '\\':
+                    escaped = True
+                elif char == '"':
+                    in_string = False
+            elif char == '"' and depth:
+                in_string = True
+            elif char == '{':
+                depth += 1
+            elif char == '}' and depth:
+                depth -= 1
+                if not depth:
+                    closed = True
+                    break
+
+        if closed:
+            finish_reason = finish_reason or "stop"
+            if hasattr(stream, "close"):
+                stream.close()
             break
-    
-    return lines
+
+    response = SimpleNamespace(
+        choices=[SimpleNamespace(
+            message=SimpleNamespace(content="".join(parts)),
+            finish_reason=finish_reason
+        )]
+    )
+    if usage is not None:
+        response.usage = usage
+    return response
 
 
 def edit_diagram_mermaid(user_prompt: str, existing_mermaid_code: str, api_key: str = None) -> str:
@@ -918,12 +1250,32 @@ def edit_diagram_mermaid(user_prompt: str, existing_mermaid_code: str, api_key:
     Returns:
         str: The updated Mermaid code for the UML diagram.
     """
+    cache_key = _edit_cache_key(user_prompt, existing_mermaid_code)
+    with _EDIT_CACHE_LOCK:
+        cached = _EDIT_CACHE.get(cache_key)
+        if cached is not None:
+            _EDIT_CACHE.move_to_end(cache_key)
+    if cached is not None:
+        logger.info(f"Serving repeated edit request from cache: {preview(user_prompt)}")
+        return cached
+
+    # Trivial requests are applied locally; if nothing changes (e.g. the name is
+    # spelled differently in the diagram) the LLM gets to interpret the request
+    local_instructions = _local_edit_instructions(user_prompt, existing_mermaid_code)
+    if local_instructions is not None:
+        updated_mermaid_code = apply_mermaid_edit(existing_mermaid_code, local_instructions)
+        if updated_mermaid_code != existing_mermaid_code:
+            logger.info(f"Applied edit request locally without an LLM call: {preview(user_prompt)}")
+            _remember_edit(cache_key, updated_mermaid_code)
+            return updated_mermaid_code
+
     try:
         openai_client = get_openai_client(api_key)
         
         system_prompt = MERMAID_EDIT_SYSTEM_PROMPT
 
-        # Create a user message that includes both the existing code and the edit request
+        # Create a user message that includes both the existing code and the edit request.
+        # Everything variable goes after the static system prompt so the prefix stays cacheable.
         user_message = f"""Existing Mermaid diagram code:
 {existing_mermaid_code}
 
@@ -931,7 +1283,7 @@ User's edit request: {user_prompt}
 
 Generate edit instructions in JSON format as specified in the system prompt."""
 
-        logger.info(f"Editing Mermaid UML diagram. Edit request: {user_prompt[:100]}...")
+        logger.info(f"Editing Mermaid UML diagram. Edit request: {preview(user_prompt)}")
         logger.debug(f"Existing code length: {len(existing_mermaid_code)} chars")
 
         messages = [
@@ -939,13 +1291,21 @@ Generate edit instructions in JSON format as specified in the system prompt."""
             {"role": "user", "content": user_message}
         ]
 
-        response = openai_client.chat.completions.create(
+        stream = create_chat_completion(
+            openai_client,
             model=OPENAI_MODEL_NAME,
             messages=messages,
             temperature=0.3,
             top_p=0.7,
-            stream=False,
+            stream=True,
+            stream_options={"include_usage": True},
+            # Constrain decoding to the edit schema so the answer is always parseable JSON
+            response_format=_EDIT_RESPONSE_FORMAT,
+            # Route edits to the same cache shard so the shared system prompt prefix
+            # is served from OpenAI's prompt cache; sent via extra_body for older SDKs
+            extra_body={"prompt_cache_key": _EDIT_PROMPT_CACHE_KEY},
         )
+        response = _collect_streamed_json(stream)
 
         # Log the LLM call
         log_llm_call(
@@ -959,28 +1319,16 @@ Generate edit instructions in JSON format as specified in the system prompt."""
 
         raw_answer = response.choices[0].message.content.strip()
         
-        # Extract JSON from response (remove markdown code blocks if present)
-        json_text = raw_answer
-        if '```' in json_text:
-            # Try to extract JSON from code blocks
-            json_match = re.search(r'```(?:json)?\s*(\{.*\})\s*```', json_text, re.DOTALL)
-            if json_match:
-                json_text = json_match.group(1)
-        else:
-            # Try to find JSON object in the text
-            json_match = re.search(r'\{.*\}', json_text, re.DOTALL)
-            if json_match:
-                json_text = json_match.group(0)
-        
-        # Parse JSON edit instructions
+        # Parse and validate JSON edit instructions in one pass; response_format
+        # guarantees a bare JSON object, so there is no fence or prose to strip
         try:
-            edit_instructions = json.loads(json_text)
-        except json.JSONDecodeError as e:
+            edit_instructions = EditInstructions.model_validate_json(raw_answer).model_dump(exclude_none=True)
+        except ValidationError as e:
             logger.error(f"Failed to parse JSON edit instructions: {e}")
-            logger.error(f"Raw response: {raw_answer[:500]}")
+            logger.error(f"Raw response: {preview(raw_answer, 500)}")
             raise ValueError(f"Failed to parse edit instructions as JSON: {e}")
         
-        logger.info(f"Parsed edit instructions with {len(edit_instructions.get('edits', []))} edits")
+        logger.info(f"Parsed edit instructions with {len(edit_instructions['edits'])} edits")
         
         # Apply edits using the reliable edit application function
         updated_mermaid_code = apply_mermaid_edit(existing_mermaid_code, edit_instructions)
@@ -992,9 +1340,10 @@ Generate edit instructions in JSON format as specified in the system prompt."""
             mermaid_code=updated_mermaid_code,
             code_type="post_edit",
             function_name="edit_diagram_mermaid",
-            context=f"Edit request: {user_prompt[:200]}"
+            context=f"Edit request: {preview(user_prompt, 200)}"
         )
         
+        _remember_edit(cache_key, updated_mermaid_code)
         return updated_mermaid_code
 
     except Exception as e:
@@ -1013,3 +1362,76 @@ Generate edit instructions in JSON format as specified in the system prompt."""
         logger.error(f"Error while editing Mermaid diagram: {e}", exc_info=True)
         raise
 
+
+def edit_diagrams_multi(requests: List[Tuple[str, str]], api_key: str = None) -> List[str]:
+    """
+    Applies several independent edit requests using a single OpenAI call, so the
+    system prompt is only sent once for the whole batch.
+
+    Args:
+        requests (List[Tuple[str, str]]): (user_prompt, existing_mermaid_code) pairs.
+        api_key (str): Optional OpenAI API key.
+
+    Returns:
+        List[str]: The updated Mermaid code for each request, in the same order.
+    """
+    if not requests:
+        return []
+
+    messages = [
+        {"role": "system", "content": MERMAID_EDIT_SYSTEM_PROMPT + MERMAID_EDIT_BATCH_INSTRUCTIONS},
+        {"role": "user", "content": orjson.dumps({"requests": [
+            {"id": i, "diagram": code, "prompt": prompt} for i, (prompt, code) in enumerate(requests)
+        ]}).decode()}
+    ]
+
+    try:
+        openai_client = get_openai_client(api_key)
+
+        logger.info(f"Editing {len(requests)} Mermaid diagrams in one batch")
+
+        response = create_chat_completion(
+            openai_client,
+            model=OPENAI_MODEL_NAME,
+            messages=messages,
+            temperature=0.3,
+            top_p=0.7,
+            response_format={"type": "json_object"},
+            stream=False,
+        )
+
+        log_llm_call(
+            model=OPENAI_MODEL_NAME,
+            messages=messages,
+            response=response,
+            temperature=0.3,
+            top_p=0.7,
+            function_name="edit_diagrams_multi"
+        )
+
+        try:
+            results = orjson.loads(response.choices[0].message.content)["results"]
+            by_id = {int(r["id"]): r["edits"] for r in results}
+        except (orjson.JSONDecodeError, KeyError, TypeError, ValueError) as e:
+            raise ValueError(f"Failed to parse batched edit response: {e}")
+
+        missing = [i for i in range(len(requests)) if i not in by_id]
+        if missing:
+            raise ValueError(f"Batched edit response is missing results for ids {missing}")
+
+        updated_codes = [apply_mermaid_edit(code, {"edits": by_id[i]}) for i, (_, code) in enumerate(requests)]
+
+        logger.info(f"Applied {len(updated_codes)} Mermaid diagram edits in one batch")
+        return updated_codes
+
+    except Exception as e:
+        log_llm_call(
+            model=OPENAI_MODEL_NAME,
+            messages=messages,
+            temperature=0.3,
+            top_p=0.7,
+            error=str(e),
+            function_name="edit_diagrams_multi"
+        )
+        logger.error(f"Error while editing batched Mermaid diagrams: {e}", exc_info=True)
+        raise
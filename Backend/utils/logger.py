@@ -1,19 +1,104 @@
+import atexit
 import logging
+import logging.handlers
+import os
+import queue
 import sys
-import json
 from typing import List, Dict, Any, Optional
 
-# Configure logging
+import orjson
+
+
+class _AppendFileHandler(logging.Handler):
+    """Appends each record to a file as one pre-encoded UTF-8 write on a raw O_APPEND descriptor."""
+
+    def __init__(self, path: str):
+        super().__init__()
+        self._fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+
+    def emit(self, record):
+        try:
+            os.write(self._fd, (self.format(record) + '\n').encode('utf-8'))
+        except Exception:
+            self.handleError(record)
+
+    def close(self):
+        self.acquire()
+        try:
+            if self._fd >= 0:
+                os.close(self._fd)
+                self._fd = -1
+        finally:
+            self.release()
+        super().close()
+
+
+# Records are handed to a queue on the request path and written out by a
+# background listener thread, so a slow console or disk never blocks an LLM round-trip.
+_formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+_stdout_handler = logging.StreamHandler(sys.stdout)
+_stdout_handler.setFormatter(_formatter)
+_log_queue = queue.SimpleQueue()
+_log_listener: Optional[logging.handlers.QueueListener] = None
+
+
+def configure(log_file: Optional[str] = None) -> None:
+    """
+    Selects where log output goes: stdout always, plus log_file when given.
+    Called at import with the LOG_FILE environment variable; calling it again
+    swaps the outputs without touching loggers or the request-path queue.
+
+    Args:
+        log_file (str): Optional path to append log lines to. The file is opened
+            once and kept open; only the listener thread writes to it, one
+            UTF-8 encoded line per os.write with no text-layer buffering.
+    """
+    global _log_listener
+    if _log_listener is not None:
+        _log_listener.stop()
+        for handler in _log_listener.handlers:
+            if handler is not _stdout_handler:
+                handler.close()
+
+    handlers = [_stdout_handler]
+    if log_file:
+        file_handler = _AppendFileHandler(log_file)
+        file_handler.setFormatter(_formatter)
+        handlers.append(file_handler)
+
+    _log_listener = logging.handlers.QueueListener(_log_queue, *handlers)
+    _log_listener.start()
+
+
+def _stop_listener() -> None:
+    """Drain pending records on shutdown."""
+    if _log_listener is not None:
+        _log_listener.stop()
+
+
+# Log file is off by default: serverless deployments have a read-only disk
+configure(os.getenv("LOG_FILE"))
+atexit.register(_stop_listener)
+
+# The queue handler only merges msg and args; the output handlers apply the full format
+_queue_handler = logging.handlers.QueueHandler(_log_queue)
+_queue_handler.setFormatter(logging.Formatter('%(message)s'))
+
 logging.basicConfig(
     level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
     handlers=[
-        logging.StreamHandler(sys.stdout)
+        _queue_handler
     ]
 )
 
 logger = logging.getLogger(__name__)
 
+
+def preview(text: str, limit: int = 100) -> str:
+    """Truncate text for a log line, marking the cut with "..." only when one was made."""
+    return text if len(text) <= limit else text[:limit] + "..."
+
+
 def log_llm_call(
     model: str,
     messages: List[Dict[str, str]],
@@ -34,16 +119,19 @@ def log_llm_call(
         }
         
         if error:
-            logger.error(f"LLM Call Error: {json.dumps(log_entry)}")
+            logger.error(f"LLM Call Error: {orjson.dumps(log_entry).decode()}")
         else:
             # For success, just log a summary to avoid cluttering logs
-            if response and hasattr(response, 'usage'):
+            try:
+                usage = response.usage
                 log_entry['usage'] = {
-                    "prompt_tokens": response.usage.prompt_tokens,
-                    "completion_tokens": response.usage.completion_tokens,
-                    "total_tokens": response.usage.total_tokens
+                    "prompt_tokens": usage.prompt_tokens,
+                    "completion_tokens": usage.completion_tokens,
+                    "total_tokens": usage.total_tokens
                 }
-            logger.info(f"LLM Call Success: {json.dumps(log_entry)}")
+            except AttributeError:
+                pass  # no response, or one without usage (e.g. a stream)
+            logger.info(f"LLM Call Success: {orjson.dumps(log_entry).decode()}")
             
     except Exception as e:
         logger.error(f"Failed to log LLM call: {e}")
@@ -58,8 +146,9 @@ def log_mermaid_code(
     Log generated mermaid code to console.
     """
     try:
-        logger.info(f"Mermaid Code ({code_type}) from {function_name}: {len(mermaid_code)} chars")
+        # Lazy %-style args: the message is only assembled if a handler emits it
+        logger.info("Mermaid Code (%s) from %s: %d chars", code_type, function_name, len(mermaid_code))
         # Optional: Log the first few lines if needed for debug
-        # logger.info(f"Preview: {mermaid_code[:100]}...")
+        # logger.info(f"Preview: {preview(mermaid_code)}")
     except Exception as e:
         logger.error(f"Failed to log mermaid code: {e}")
\ No newline at end of file